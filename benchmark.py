@@ -0,0 +1,472 @@
+#!/usr/bin/python
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import argparse
+import resource
+import tempfile
+import threading
+import socketserver
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote
+
+import transcribe
+
+# Offline benchmark of the transcriber. A local server stands in for the OLD and serves recorded pages - either the ones
+# saved with --store-pages or a small built-in set - and the same code paths the script uses are driven over fixed corpora.
+
+# The origin of the recorded URLs, replaced by the local server's.
+OLD_ORIGIN = "https://www.oxfordlearnersdictionaries.com"
+
+# Page returned by the OLD for words it doesn't know - a list of search results.
+SEARCH_RESULTS_PAGE = '<html><body><div id="search-results"><h1>No exact match found for this word</h1></div></body></html>'
+
+# Filler that follows the transcriptions on every built-in page, so pages are about as large as the real ones.
+DEFINITIONS_FILLER = '<li class="sense"><span class="def">' + "a definition of the word " * 40 + '</span></li>'
+
+# The built-in recording: head word -> (part of speech, transcriptions). The transcriptions of verbs are followed by
+# the ones of their forms, like on the OLD.
+FIXTURE_ENTRIES = {
+    "walk": ("verb", ["wɔːk", "wɔːk", "wɔːks", "wɔːkt", "wɔːkt", "ˈwɔːkɪŋ"]),
+    "think": ("verb", ["θɪŋk", "θɪŋk", "θɪŋks", "θɔːt", "θɔːt", "ˈθɪŋkɪŋ"]),
+    "play": ("verb", ["pleɪ", "pleɪ", "pleɪz", "pleɪd", "pleɪd", "ˈpleɪɪŋ"]),
+    "cat": ("noun", ["kæt"]),
+    "dog": ("noun", ["dɒɡ"]),
+    "house": ("noun", ["haʊs"]),
+    "year": ("noun", ["jɪə(r)"]),
+    "thinker": ("noun", ["ˈθɪŋkə(r)"]),
+    "teacher": ("noun", ["ˈtiːtʃə(r)"]),
+    "old": ("adjective", ["əʊld"]),
+    "quick": ("adjective", ["kwɪk"]),
+    "happy": ("adjective", ["ˈhæpi"]),
+    "green": ("adjective", ["ɡriːn"]),
+    "quickly": ("adverb", ["ˈkwɪkli"]),
+}
+
+# Inflected forms the OLD redirects to the entry of their head word.
+FIXTURE_FORMS = {"walked": "walk", "walking": "walk", "thinking": "think", "played": "play"}
+
+# Words whose search page is answered with a 404 by the built-in recording.
+FIXTURE_MISSING = ["zzyzx"]
+
+# The corpora. Single words cover plain look-ups, inflections, prefixes, irregular verbs, contractions and words that
+# aren't found; the phrases cover the complex-word path.
+WORD_CORPUS = ["walk", "walks", "walked", "walking", "cats", "cat's", "dogs'", "houses", "thinkers", "teacher",
+               "quicker", "quickest", "quickly", "happiness", "unhappy", "rethink", "replays", "overthinkers", "hid",
+               "I'll", "green", "greener", "years", "zzyzx", "qwrtp"]
+COMPLEX_CORPUS = ["old-year", "walk the dog", "green house", "happy cat", "cat/dog", "quick-thinking", "old teacher",
+                  "play with cats", "dog-walker", "year-old"]
+
+# Every scenario runs over its corpus this many times by default.
+CORPUS_REPEAT = 4
+
+# Metrics compared against the baseline, and whether a higher value is better.
+COMPARED_METRICS = [("words_per_sec", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False),
+                    ("requests_per_word", False), ("peak_rss_kb", False)]
+
+def fixturePage(headWord, partOfSpeech, transcriptions):
+    phonetics = "".join('<div class="phons_br"><span class="phon">/{0}/</span></div>'.format(transcription) for transcription in transcriptions)
+    return ('<html><body><div class="entry"><h1 class="headword">{0}</h1><span class="pos">{1}</span>{2}'
+            '<ol class="senses_multiple">{3}</ol></div></body></html>').format(headWord, partOfSpeech, phonetics, DEFINITIONS_FILLER * 20)
+
+# Records the built-in pages into a PageStore, the same way --store-pages records the OLD: every search URL of a known
+# word redirects to its entry.
+def buildFixture(filename):
+    pages = transcribe.PageStore(filename)
+    for headWord, (partOfSpeech, transcriptions) in FIXTURE_ENTRIES.items():
+        entryURL = OLD_ORIGIN + "/definition/english/" + headWord + "_1"
+        pages.put(transcribe.baseURL + headWord, entryURL, 200, fixturePage(headWord, partOfSpeech, transcriptions).encode())
+    for form, headWord in FIXTURE_FORMS.items():
+        entryURL = OLD_ORIGIN + "/definition/english/" + headWord + "_1"
+        pages.put(transcribe.baseURL + form, entryURL, 200, pages.get(entryURL).data)
+    for word in FIXTURE_MISSING:
+        pages.put(transcribe.baseURL + word, None, 404, b"<html><body>Not Found</body></html>")
+    return pages
+
+# A local stand-in for the OLD which serves the pages of a PageStore. Requested URLs that redirected when they were
+# recorded are answered with a redirect, URLs that weren't recorded with the search results page.
+class RecordedServer:
+    def __init__(self, pages, latency=0):
+        self.pages = pages
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def baseURL(self):
+        return "http://127.0.0.1:{0}".format(self.server.server_port) + transcribe.baseURL[len(OLD_ORIGIN):]
+
+    def handler(self):
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # The headers and the body are sent separately, which Nagle's algorithm would delay on a kept-alive connection.
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                URL = OLD_ORIGIN + unquote(self.path)
+                page = server.pages.get(URL)
+                if page is None:
+                    self.respond(200, SEARCH_RESULTS_PAGE.encode())
+                elif page.geturl() != URL:
+                    self.send_response(302)
+                    self.send_header("Location", urlsplit(page.geturl())._replace(scheme="", netloc="").geturl())
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                else:
+                    self.respond(page.status, page.data)
+
+            def respond(self, status, body):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        return Handler
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# A local stand-in for a Redis server, with just the commands RedisCache and RedisPageStore send: AUTH, SELECT, GET, MGET,
+# SET (with EX), TTL, DEL and SCAN. The keys are kept in memory, per database. Connections have to authenticate with the
+# password first if one is given.
+class RespServer:
+    def __init__(self, password=None):
+        self.password = password
+        self.databases = dict()
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, password=None, database=0):
+        return "redis://{0}127.0.0.1:{1}/{2}".format(":" + password + "@" if password is not None else "", self.server.server_address[1], database)
+
+    def handler(self):
+        server = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.authenticated = server.password is None
+                self.database = 0
+                while True:
+                    command = self.readCommand()
+                    if command is None:
+                        return
+                    try:
+                        reply = self.execute(command[0].decode().upper(), command[1:])
+                    except (ValueError, IndexError):
+                        reply = ValueError("ERR syntax error")
+                    self.wfile.write(self.encode(reply))
+
+            # Reads an array of bulk strings, or returns None once the client is gone.
+            def readCommand(self):
+                line = self.rfile.readline()
+                if not line.startswith(b"*"):
+                    return None
+                arguments = []
+                for index in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    arguments.append(self.rfile.read(length + 2)[:-2])
+                return arguments
+
+            def execute(self, name, arguments):
+                if name == "AUTH":
+                    if arguments[-1].decode() != server.password:
+                        return ValueError("WRONGPASS invalid username-password pair")
+                    self.authenticated = True
+                    return "OK"
+                if not self.authenticated:
+                    return ValueError("NOAUTH Authentication required.")
+                if name == "SELECT":
+                    self.database = int(arguments[0])
+                    return "OK"
+                with server.lock:
+                    keys = server.databases.setdefault(self.database, dict())
+                    # Expired keys are only removed once they're used.
+                    now = time.time()
+                    for key in [key for key, (value, expires) in keys.items() if expires is not None and expires <= now]:
+                        del keys[key]
+                    if name == "GET":
+                        return keys.get(arguments[0], (None, None))[0]
+                    if name == "MGET":
+                        return [keys.get(key, (None, None))[0] for key in arguments]
+                    if name == "SET":
+                        expires = now + int(arguments[3]) if len(arguments) > 3 and arguments[2].upper() == b"EX" else None
+                        keys[arguments[0]] = (arguments[1], expires)
+                        return "OK"
+                    if name == "TTL":
+                        if arguments[0] not in keys:
+                            return -2
+                        expires = keys[arguments[0]][1]
+                        return -1 if expires is None else int(round(expires - now))
+                    if name == "DEL":
+                        return sum(keys.pop(key, None) is not None for key in arguments)
+                    if name == "SCAN":
+                        # Everything is returned at once, with the cursor that ends the iteration.
+                        pattern = arguments[arguments.index(b"MATCH") + 1].decode() if b"MATCH" in arguments else "*"
+                        return [b"0", [key for key in keys if fnmatch.fnmatchcase(key.decode(), pattern)]]
+                return ValueError("ERR unknown command '{0}'".format(name))
+
+            def encode(self, reply):
+                if reply is None:
+                    return b"$-1\r\n"
+                if isinstance(reply, ValueError):
+                    return b"-" + str(reply).encode() + b"\r\n"
+                if isinstance(reply, str):
+                    return b"+" + reply.encode() + b"\r\n"
+                if isinstance(reply, int):
+                    return b":%d\r\n" % reply
+                if isinstance(reply, list):
+                    return b"*%d\r\n" % len(reply) + b"".join(self.encode(item) for item in reply)
+                return b"$%d\r\n%s\r\n" % (len(reply), reply)
+        return Handler
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# A Transcriber that measures how long each word takes.
+class TimedTranscriber(transcribe.Transcriber):
+    def __init__(self, *args, **kwargs):
+        transcribe.Transcriber.__init__(self, *args, **kwargs)
+        self.latencies = []
+
+    def transcribeWord(self, word):
+        start = time.perf_counter()
+        try:
+            return transcribe.Transcriber.transcribeWord(self, word)
+        finally:
+            # list.append is atomic, so the worker threads don't need a lock.
+            self.latencies.append(time.perf_counter() - start)
+
+# The plaintext path: reads the words from a text file and prints their transcriptions.
+def runPlaintext(transcriber, words, jobs):
+    with redirect_stdout(io.StringIO()):
+        for word, future in transcriber.transcribeAll(transcribe.readPlaintextWords(io.StringIO("\n".join(words) + "\n")), jobs):
+            try:
+                transcribe.printTranscription(word, future.result())
+            except Exception as e:
+                print ("An error occurred at word \"{0}\". Message: {1}".format(word, e))
+
+# The spreadsheet path: reads the words from column A of a workbook and writes the transcriptions next to them.
+def runWorkbook(transcriber, words, jobs):
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    for row, word in enumerate(words, 1):
+        sheet.cell(row=row, column=1, value=word)
+    for (row, word), future in transcriber.transcribeAll(transcribe.readWorkbookWords(sheet), jobs, lambda item: item[1]):
+        try:
+            transcribe.writeTranscription(sheet, row, word, future.result())
+        except Exception:
+            pass
+    workbook.save(io.BytesIO())
+
+SCENARIOS = [
+    ("plaintext", runPlaintext, WORD_CORPUS),
+    ("xlsx", runWorkbook, WORD_CORPUS),
+    ("complex", runPlaintext, COMPLEX_CORPUS),
+]
+
+# Nearest-rank percentile of a sorted list.
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+def peakRSS():
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+# Runs a scenario against the server with a fresh transcriber (without a cache or lexicon, so every word reaches the
+# server) and returns its metrics.
+def runScenario(server, run, words, args):
+    transcriber = TimedTranscriber(jobs=args.jobs, stream=args.stream, speculate=args.speculate, baseURL=server.baseURL)
+    with transcriber:
+        requestsBefore = server.requests
+        start = time.perf_counter()
+        run(transcriber, words, transcriber.jobs)
+        elapsed = time.perf_counter() - start
+        requests = server.requests - requestsBefore
+    latencies = sorted(transcriber.latencies)
+    return {
+        "words": len(words),
+        "seconds": round(elapsed, 4),
+        "words_per_sec": round(len(words) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "requests_per_word": round(requests / len(words), 3),
+        # The peak of the whole process so far, so it never decreases from one scenario to the next.
+        "peak_rss_kb": peakRSS(),
+    }
+
+def printResults(results):
+    print ("{0:<10} {1:>7} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9} {7:>10}".format("scenario", "words", "words/s", "p50 ms", "p95 ms", "p99 ms", "req/word", "peak RSS"))
+    for name, metrics in results.items():
+        print ("{0:<10} {1:>7} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9} {7:>7} kB".format(name, metrics["words"], metrics["words_per_sec"], metrics["p50_ms"],
+               metrics["p95_ms"], metrics["p99_ms"], metrics["requests_per_word"], metrics["peak_rss_kb"]))
+
+# Prints the change of every metric relative to the baseline. Returns the regressions larger than "tolerance" percent.
+def compareResults(results, baseline, tolerance):
+    regressions = []
+    print ("\nCompared to the baseline:")
+    for name, metrics in results.items():
+        if name not in baseline:
+            print ("{0:<10} not in the baseline".format(name))
+            continue
+        changes = []
+        for metric, higherIsBetter in COMPARED_METRICS:
+            before = baseline[name].get(metric)
+            if not before:
+                continue
+            change = (metrics[metric] - before) / before * 100
+            changes.append("{0} {1:+.1f}%".format(metric, change))
+            if (-change if higherIsBetter else change) > tolerance:
+                regressions.append("{0} {1}".format(name, metric))
+        print ("{0:<10} {1}".format(name, ", ".join(changes)))
+    return regressions
+
+# Transcribes the word corpus and returns the records of the results (see transcribe.transcriptionRecord), along with the
+# amount of requests the server got.
+def transcribeCorpus(server, transcriber):
+    records = []
+    requestsBefore = server.requests
+    with transcriber:
+        for word, future in transcriber.transcribeAll(WORD_CORPUS):
+            try:
+                records.append(transcribe.transcriptionRecord(word, future.result()))
+            except Exception as e:
+                records.append(transcribe.transcriptionRecord(word, error=e))
+    return records, server.requests - requestsBefore
+
+# Checks RedisCache and RedisPageStore against a RespServer: a connection that fails to authenticate, the cache operations,
+# and the word corpus transcribed through both, then from the cache alone, then reparsed from the page store alone.
+# Returns the descriptions of the checks that failed.
+def checkRedis(server, args):
+    failures = []
+    def check(condition, description):
+        if not condition:
+            failures.append(description)
+
+    redis = RespServer(password="benchmark")
+    redis.start()
+    try:
+        connection = transcribe.RedisConnection(redis.url("wrong"))
+        try:
+            connection.execute("GET", "word")
+            check(False, "AUTH with a wrong password succeeded")
+        except transcribe.RedisError:
+            pass
+        check(connection.socket is None, "the connection wasn't closed after AUTH failed")
+        connection.close()
+
+        cache = transcribe.RedisCache(redis.url("benchmark", 1), ttlDays=1)
+        cache.putMany([("Cats", [{"noun": ["kæts"]}]), ("qwrtp", None)])
+        check(cache.getMany(["cats", "qwrtp", "dogs"]) == {"cats": [{"noun": ["kæts"]}], "qwrtp": None}, "getMany returned the wrong words")
+        check(cache.get("dogs") == (False, None), "a word that wasn't cached was a cache hit")
+        check(cache.getEntries(["cats"])["cats"][1] <= 1, "a new entry wasn't new")
+        cache.putValidators("cats", {"URL": {"etag": "1"}})
+        check(cache.getValidators("cats") == {"URL": {"etag": "1"}}, "getValidators returned the wrong validators")
+        info = cache.info()
+        check(info["entries"] == 2 and info["negative"] == 1, "info counted the wrong entries")
+        check(transcribe.RedisCache(redis.url("benchmark", 2)).getMany(["cats"]) == dict(), "the databases weren't separate")
+        cache.clear()
+        check(cache.getMany(["cats", "qwrtp"]) == dict() and cache.getValidators("cats") is None, "clear left entries behind")
+        cache.close()
+
+        def redisTranscriber(cache=True, reparse=False):
+            return transcribe.Transcriber(jobs=args.jobs, cache=transcribe.RedisCache(redis.url("benchmark", 1)) if cache else None,
+                                          pageStore=transcribe.RedisPageStore(redis.url("benchmark", 1)), reparse=reparse, baseURL=server.baseURL)
+        records, requests = transcribeCorpus(server, redisTranscriber())
+        check(requests > 0, "the first run didn't reach the server")
+        cached, requests = transcribeCorpus(server, redisTranscriber())
+        check(requests == 0 and cached == records, "the second run wasn't served by the cache")
+        reparsed, requests = transcribeCorpus(server, redisTranscriber(cache=False, reparse=True))
+        check(requests == 0 and reparsed == records, "the reparsed run wasn't served by the page store")
+    finally:
+        redis.stop()
+    return failures
+
+def main():
+    argParser = argparse.ArgumentParser(description="Benchmark the transcriber offline, against a local server serving recorded OLD pages.", allow_abbrev=False)
+    argParser.add_argument("--pages", help="Page store recorded with transcribe.py --store-pages to serve. The built-in recording is used if not given.", metavar="PATH")
+    argParser.add_argument("--scenario", help="Run only the given scenario(s).", choices=[name for name, run, words in SCENARIOS], action="append")
+    argParser.add_argument("--repeat", help="How many times each corpus is transcribed (default: %(default)s).", type=int, default=CORPUS_REPEAT, metavar="N")
+    argParser.add_argument("--latency", help="Delay the server adds to every response, in milliseconds (default: %(default)s).", type=float, default=0, metavar="MS")
+    argParser.add_argument("-j", "--jobs", help="Transcribe up to N words concurrently (default: %(default)s).", type=int, default=transcribe.JOBS, metavar="N")
+    argParser.add_argument("--stream", help="Benchmark with --stream.", action="store_true")
+    argParser.add_argument("--speculate", help="Benchmark with --speculate.", action="store_true")
+    argParser.add_argument("--save-baseline", help="Save the results as the baseline.", metavar="PATH")
+    argParser.add_argument("--baseline", help="Compare the results to a baseline saved with --save-baseline.", metavar="PATH")
+    argParser.add_argument("--check-redis", help="Instead of the benchmark, check the Redis cache and page store against a local stand-in for a Redis server.", action="store_true")
+    argParser.add_argument("--tolerance", help="Exit with an error if a metric is worse than the baseline by more than this many percent (default: %(default)s).", type=float, default=10, metavar="PERCENT")
+    args = argParser.parse_args()
+
+    temporaryDirectory = None
+    if args.pages is not None:
+        pages = transcribe.PageStore(args.pages)
+    else:
+        temporaryDirectory = tempfile.mkdtemp(prefix="transcriber-benchmark-")
+        pages = buildFixture(os.path.join(temporaryDirectory, "pages.sqlite3"))
+
+    server = RecordedServer(pages, args.latency / 1000)
+    server.start()
+    results = dict()
+    failures = None
+    try:
+        if args.check_redis:
+            failures = checkRedis(server, args)
+        else:
+            for name, run, words in SCENARIOS:
+                if args.scenario is None or name in args.scenario:
+                    results[name] = runScenario(server, run, words * args.repeat, args)
+    finally:
+        server.stop()
+        pages.close()
+        if temporaryDirectory is not None:
+            shutil.rmtree(temporaryDirectory)
+
+    if failures is not None:
+        for failure in failures:
+            print ("Failed:", failure)
+        print ("Redis check {0}.".format("passed" if len(failures) == 0 else "failed"))
+        sys.exit(1 if len(failures) > 0 else 0)
+
+    printResults(results)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print ("\nSaved the baseline to", args.save_baseline)
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            regressions = compareResults(results, json.load(file), args.tolerance)
+        if len(regressions) > 0:
+            print ("\nRegressed by more than {0}%: {1}".format(args.tolerance, ", ".join(regressions)))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,115 @@
 #!/usr/bin/python
 import os
 import sys
+import json
+import time
+import zlib
+import csv
+import mmap
+import codecs
+import queue
+import struct
+import socket
+import sqlite3
+import hashlib
 import argparse
-import urllib3
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from html.parser import HTMLParser
-from openpyxl import load_workbook
 from re import split
+# urllib3 and openpyxl are imported where they're needed, so importing this module (or transcribing a plaintext file)
+# doesn't pay for them.
 
 VERBOSE_DEBUG = False
-PLAINTEXT = False
-FILENAME = ""
+# Number of words transcribed concurrently.
+JOBS = 1
 WORD_SEPARATORS = [" ", "-", "—", "/", "[", "]"]
 # The list below is unused due to issues with malformed output
 CHARACTERS_TO_STRIP = "\r\n'‘’ "
 
+# Persistent cache of getTranscription results, see TranscriptionCache.
+CACHE_FILENAME = os.path.join(os.path.expanduser("~"), ".cache", "transcriber", "cache.sqlite3")
+# Entries older than this (in days) are ignored and fetched again.
+CACHE_TTL_DAYS = 30
+# Maximum amount of cached words - once exceeded, the least recently used ones are evicted.
+CACHE_MAX_ENTRIES = 100000
+# Amount of words read from or written to the cache in a single request, see Transcriber.cacheBatch.
+CACHE_BATCH_SIZE = 500
+# Cached words younger than this (in days) aren't revalidated by warmCache.
+WARM_REFRESH_DAYS = 7
+# Port of servers speaking the Redis protocol when the URL of a shared cache doesn't give one, see RedisConnection.
+REDIS_PORT = 6379
+
+# Settings of the HTTP client shared by all lookups, see HttpClient.
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+# Maximum amount of requests per second sent to the OLD, 0 for no limit.
+HTTP_RATE_LIMIT = 0
+HTTP_BURST = 5
+# Statuses which are considered transient - requests which get these are retried.
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# Redirects a request may follow - every search of the OLD redirects to an entry, so they don't take from the retries.
+HTTP_MAX_REDIRECTS = 5
+# Seconds a request may take to connect and between two reads, 0 for no limit.
+HTTP_TIMEOUT = 10
+# Seconds a word may take altogether, 0 for no limit, see Transcriber.transcribeWord.
+WORD_DEADLINE = 0
+# Hedged requests - a duplicate request is sent once a request takes longer than this percentile of the recent ones (the
+# last HEDGE_WINDOW, once there are at least HEDGE_MIN_SAMPLES of them).
+HEDGE_PERCENTILE = 95
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+# The circuit breaker opens after this many failed requests in a row (0 to never open it) and lets a single request through
+# to probe the OLD after BREAKER_RESET seconds, see CircuitBreaker.
+BREAKER_FAILURES = 5
+BREAKER_RESET = 30
+
+# Streaming (see Transcriber.feedPage) - pages are parsed while they're being downloaded and reading stops once the parser
+# has everything it needs.
+STREAM_CHUNK_SIZE = 8192
+# When reading stops early, the rest of a response up to this size (in bytes) is still read so the connection can be
+# reused. Larger remainders are discarded by closing the connection.
+STREAM_DRAIN_LIMIT = 64 * 1024
+# Classes of elements that start the definitions of an entry. Everything the parser needs (head word, part of speech,
+# transcriptions and verb forms) comes before these.
+PARSER_STOP_CLASSES = ["senses_multiple", "sense_single", "sense", "def"]
+
+# Maximum amount of concurrent speculative requests per job.
+SPECULATION_WIDTH = 4
+
+# Maximum amount of parts of complex words looked up concurrently per job, and the amount of parts whose results are kept
+# for the rest of the run, see getPart.
+PHRASE_WIDTH = 4
+PART_MEMO_SIZE = 100000
+
+# Maximum amount of lemmas whose pages are kept by --expand-inflections, see LemmaStore.
+LEMMA_STORE_SIZE = 100000
+
+# Address of the transcription service (see TranscriptionService) and the maximum amount of words waiting to be transcribed
+# before it turns new requests away.
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8000
+SERVICE_MAX_PENDING = 1000
+
+# Size of the buffer output writers write through, see openOutput.
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+# Amount of words sent to a worker process at once, see transcribeSharded.
+SHARD_SIZE = 64
+
+# Upper bounds (in seconds) of the buckets of the latency histograms, see Metrics.
+METRICS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+# Prefix of the metric names in the Prometheus textfile.
+METRICS_PREFIX = "transcriber_"
+
+# Local index of transcriptions loaded from lexicon files, checked before the OLD. See LexiconIndex.
+LEXICON_FILENAME = os.path.join(os.path.expanduser("~"), ".cache", "transcriber", "lexicon.idx")
+
+# Optional store of the raw pages returned by the OLD, see PageStore.
+PAGE_STORE_FILENAME = os.path.join(os.path.expanduser("~"), ".cache", "transcriber", "pages.sqlite3")
+
 # The URL which is used to look up words
 baseURL = "https://www.oxfordlearnersdictionaries.com/search/english/?q="
 
@@ -105,6 +201,28 @@ PREFIX_TRANSCRIPTIONS = {
     "de": "diː"
 }
 
+# How suffixes are handled. A word gets the properties of every suffix it ends with - if several of them set the same
+# property, the longest suffix wins (e.g. words ending in "ness" aren't plurals even though they end with "s").
+#   possessive - the suffix is removed before the lookup and the plural ending is added to the transcription
+#   plural     - the word might be a plural or a third person form
+#   retry      - if the word isn't found, it's looked up again without the suffix and this is added to the transcription
+#   retryPos   - the part of speech the retry transcription is added to (all of them if not set)
+#   repeat     - the retry is attempted as long as the word ends with the suffix, before any other retry
+#   degree     - added to adjectives found under a shorter head word (comparative and superlative forms)
+#   verbForm   - which of the verb forms listed by the OLD is used for the word: its index or "ing" for the -ing form
+SUFFIX_RULES = {
+    "'s": {"possessive": True, "plural": False},
+    "’s": {"possessive": True, "plural": False},
+    "s": {"plural": True, "retry": "", "repeat": True, "verbForm": 2},
+    "ss": {"verbForm": 1},
+    "ness": {"plural": False},
+    "ly": {"retry": "lɪ", "retryPos": "adjective"},
+    "er": {"retry": "ə(r)", "degree": "ə"},
+    "est": {"degree": "ɪst"},
+    "ed": {"verbForm": 3},
+    "ing": {"verbForm": "ing"}
+}
+
 # Since OLD is limited in terms of these, the transcriptions below have been fetched from Wiktionary. Might be incorrect.
 CONTRACTIONS = {
     "i've": "aɪv",
@@ -133,8 +251,10 @@ CONTRACTIONS = {
 }
 
 class DictionaryParser(HTMLParser):
-    def __init__(self):
+    # If stopEarly is set, everything after the point at which the parser is complete is ignored.
+    def __init__(self, stopEarly=False):
         HTMLParser.__init__(self)
+        self.stopEarly = stopEarly
         # Needed to differentiate between British English and American English transcriptions:
         self.isBritish = False
         self.record = False
@@ -144,6 +264,8 @@ class DictionaryParser(HTMLParser):
         self.headWord = ""
         self.notFound = False
         self.recordError = False
+        # Set once nothing else that's needed can follow, see PARSER_STOP_CLASSES.
+        self.complete = False
 
         # Record type - remembers which of the following is being recorded:
         #   t - Type (noun / verb / adjective)
@@ -153,6 +275,15 @@ class DictionaryParser(HTMLParser):
         self.recordType = ''
 
     def handle_starttag(self, tag, attrs):
+        if self.stopEarly and self.complete:
+            return
+        for attr in attrs:
+            if attr[0] == "class" and attr[1] is not None:
+                for className in attr[1].split():
+                    if className in PARSER_STOP_CLASSES:
+                        self.complete = True
+        if self.stopEarly and self.complete:
+            return
         if attrs is not None and attrs != []:
             if tag == "span":
                 if attrs[0][0] == "class":
@@ -177,6 +308,7 @@ class DictionaryParser(HTMLParser):
                     elif attr[0] == "id":
                         if attr[1] == "search-results":
                             self.notFound = True
+                            self.complete = True
                             break
                     
             elif tag == "h1":
@@ -196,6 +328,8 @@ class DictionaryParser(HTMLParser):
                 self.found[self.type] = []
 
     def handle_data(self, data):
+        if self.stopEarly and self.complete:
+            return
         if self.record == True:
             if self.recordType == 't':
                 self.type += data
@@ -207,6 +341,1093 @@ class DictionaryParser(HTMLParser):
                 if "No exact match found" in data:
                     self.notFound = True
 
+# A SQLite-backed cache which stores the final data returned by getTranscription, keyed by the normalized word.
+# Words that couldn't be found are stored as well (with empty data), so they aren't looked up again either.
+class TranscriptionCache:
+    def __init__(self, filename, ttlDays=CACHE_TTL_DAYS, maxEntries=CACHE_MAX_ENTRIES):
+        directory = os.path.dirname(filename)
+        if directory != "" and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.filename = filename
+        self.ttl = ttlDays * 24 * 60 * 60
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        # When the words read by get were last used - written in batches, so reading the cache doesn't write to it every time.
+        self.accessed = dict()
+        # How many rows were written since the last eviction - counting the rows takes a scan, so it's only done every
+        # CACHE_BATCH_SIZE writes, and the cache may go over its cap by less than that in between.
+        self.written = 0
+        # The connection is shared by all worker threads, the lock serializes its use.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS transcriptions (word TEXT PRIMARY KEY, data TEXT, created REAL NOT NULL, accessed REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS transcriptions_accessed ON transcriptions (accessed)")
+        # The ETag and Last-Modified headers of the pages each word was looked up from, see warmCache.
+        self.connection.execute("CREATE TABLE IF NOT EXISTS validators (word TEXT PRIMARY KEY, pages TEXT NOT NULL)")
+        self.connection.commit()
+
+    # Returns a tuple (found, data) - "found" tells a cached negative result (data is None) apart from a cache miss.
+    def get(self, word):
+        key = normalizeWord(word)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT data, created FROM transcriptions WHERE word = ?", (key,)).fetchone()
+            if row is None or (self.ttl > 0 and now - row[1] > self.ttl):
+                self.misses += 1
+                return False, None
+            self.accessed[key] = now
+            if len(self.accessed) >= CACHE_BATCH_SIZE:
+                self.writeAccessed()
+                self.connection.commit()
+            self.hits += 1
+        if row[0] is None:
+            return True, None
+        return True, json.loads(row[0])
+
+    # Returns a dictionary with the data of the words that are cached, keyed by the normalized word - a word that's missing
+    # from it is a cache miss, one with None a cached negative result.
+    def getMany(self, words):
+        keys = list(set(normalizeWord(word) for word in words))
+        now = time.time()
+        found = dict()
+        with self.lock:
+            for start in range(0, len(keys), CACHE_BATCH_SIZE):
+                chunk = keys[start:start + CACHE_BATCH_SIZE]
+                rows = self.connection.execute("SELECT word, data, created FROM transcriptions WHERE word IN ({0})".format(",".join("?" * len(chunk))),
+                                               chunk).fetchall()
+                rows = [row for row in rows if self.ttl <= 0 or now - row[2] <= self.ttl]
+                self.connection.executemany("UPDATE transcriptions SET accessed = ? WHERE word = ?", [(now, row[0]) for row in rows])
+                for word, data, created in rows:
+                    found[word] = None if data is None else json.loads(data)
+            self.connection.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    # Returns a dictionary of tuples (data, age in seconds) of the cached words, including expired ones, keyed by the normalized
+    # word. Unlike getMany, it doesn't count as using the entries.
+    def getEntries(self, words):
+        keys = list(set(normalizeWord(word) for word in words))
+        now = time.time()
+        entries = dict()
+        with self.lock:
+            for start in range(0, len(keys), CACHE_BATCH_SIZE):
+                chunk = keys[start:start + CACHE_BATCH_SIZE]
+                for word, data, created in self.connection.execute("SELECT word, data, created FROM transcriptions WHERE word IN ({0})".format(",".join("?" * len(chunk))),
+                                                                   chunk):
+                    entries[word] = (None if data is None else json.loads(data), now - created)
+        return entries
+
+    # Returns the validators of the pages the word was looked up from as a dictionary keyed by URL, where each of them is a
+    # dictionary {"etag": ..., "modified": ...}, or None if there are none.
+    def getValidators(self, word):
+        with self.lock:
+            row = self.connection.execute("SELECT pages FROM validators WHERE word = ?", (normalizeWord(word),)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def putValidators(self, word, pages):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO validators (word, pages) VALUES (?, ?)", (normalizeWord(word), json.dumps(pages)))
+            self.connection.commit()
+
+    def put(self, word, data):
+        self.putMany([(word, data)])
+
+    # Caches the data of several words at once, given as tuples (word, data).
+    def putMany(self, items):
+        now = time.time()
+        rows = [(normalizeWord(word), None if data is None else json.dumps(data, ensure_ascii=False), now, now) for word, data in items]
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO transcriptions (word, data, created, accessed) VALUES (?, ?, ?, ?)", rows)
+            self.written += len(rows)
+            if self.written >= CACHE_BATCH_SIZE:
+                # Eviction goes by the time of use, so it has to be up to date.
+                self.writeAccessed()
+                self.evict()
+                self.written = 0
+            self.connection.commit()
+
+    # Writes the times of use collected by get. Expects the lock to be held, the caller commits.
+    def writeAccessed(self):
+        if len(self.accessed) > 0:
+            self.connection.executemany("UPDATE transcriptions SET accessed = ? WHERE word = ?", [(now, word) for word, now in self.accessed.items()])
+            self.accessed.clear()
+
+    # Removes the least recently used entries above the size cap. Expects the lock to be held.
+    def evict(self):
+        if self.maxEntries <= 0:
+            return
+        count = self.connection.execute("SELECT COUNT(*) FROM transcriptions").fetchone()[0]
+        if count > self.maxEntries:
+            self.connection.execute("DELETE FROM transcriptions WHERE word IN (SELECT word FROM transcriptions ORDER BY accessed ASC LIMIT ?)",
+                                    (count - self.maxEntries,))
+            self.connection.execute("DELETE FROM validators WHERE word NOT IN (SELECT word FROM transcriptions)")
+
+    def clear(self):
+        with self.lock:
+            self.accessed.clear()
+            self.connection.execute("DELETE FROM transcriptions")
+            self.connection.execute("DELETE FROM validators")
+            self.connection.commit()
+            self.connection.execute("VACUUM")
+
+    def info(self):
+        with self.lock:
+            total, negative, oldest, newest = self.connection.execute(
+                "SELECT COUNT(*), SUM(data IS NULL), MIN(created), MAX(created) FROM transcriptions").fetchone()
+            expired = 0
+            if self.ttl > 0:
+                expired = self.connection.execute("SELECT COUNT(*) FROM transcriptions WHERE created < ?", (time.time() - self.ttl,)).fetchone()[0]
+        return {
+            "file": self.filename,
+            "size": os.path.getsize(self.filename),
+            "entries": total,
+            "negative": negative or 0,
+            "expired": expired,
+            "oldest": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(oldest)) if oldest else None,
+            "newest": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(newest)) if newest else None,
+        }
+
+    def close(self):
+        with self.lock:
+            self.writeAccessed()
+            # The rows written since the last eviction would otherwise never be evicted when every run writes only a few.
+            if self.written > 0:
+                self.evict()
+            self.connection.commit()
+            self.connection.close()
+
+class RedisError(Exception):
+    pass
+
+# A minimal client for servers speaking the Redis protocol (RESP), with just what RedisCache and RedisPageStore need. The URL
+# has the form redis://[[user]:password@]host[:port][/database]. Commands given to pipeline are sent together and share a
+# single round trip. The connection is shared by all worker threads, the lock serializes its use; it's opened when it's
+# first needed and again after it has failed.
+class RedisConnection:
+    def __init__(self, url, timeout=HTTP_TIMEOUT):
+        from urllib.parse import urlsplit, unquote
+        parts = urlsplit(url)
+        self.address = (parts.hostname or "localhost", parts.port or REDIS_PORT)
+        self.username = unquote(parts.username) if parts.username else None
+        self.password = unquote(parts.password) if parts.password else None
+        self.database = int(parts.path.strip("/") or 0)
+        self.timeout = timeout if timeout > 0 else None
+        self.lock = threading.Lock()
+        self.socket = None
+        self.reader = None
+
+    def connect(self):
+        self.socket = socket.create_connection(self.address, self.timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.socket.makefile("rb")
+        commands = []
+        if self.password is not None:
+            commands.append(("AUTH", self.username, self.password) if self.username is not None else ("AUTH", self.password))
+        if self.database != 0:
+            commands.append(("SELECT", self.database))
+        if len(commands) > 0:
+            try:
+                self.send(commands)
+            except Exception:
+                # An unauthenticated connection (or one to the wrong database) must not be used by the next command.
+                self.disconnect()
+                raise
+
+    def execute(self, *command):
+        return self.pipeline([command])[0]
+
+    # Sends the commands and returns their replies. If any of them failed, the first error is raised once all replies have
+    # been read.
+    def pipeline(self, commands):
+        with self.lock:
+            if self.socket is None:
+                self.connect()
+            try:
+                return self.send(commands)
+            except (OSError, ValueError):
+                self.disconnect()
+                raise
+
+    # Expects the lock to be held.
+    def send(self, commands):
+        buffer = bytearray()
+        for command in commands:
+            buffer += b"*%d\r\n" % len(command)
+            for argument in command:
+                if not isinstance(argument, bytes):
+                    argument = str(argument).encode()
+                buffer += b"$%d\r\n%s\r\n" % (len(argument), argument)
+        self.socket.sendall(buffer)
+        replies = [self.readReply() for command in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def readReply(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("The connection to {0}:{1} was closed".format(*self.address))
+        kind, value = line[:1], line[1:-2]
+        if kind == b"+":
+            return value.decode()
+        if kind == b"-":
+            return RedisError(value.decode())
+        if kind == b":":
+            return int(value)
+        if kind == b"$":
+            if int(value) < 0:
+                return None
+            return self.reader.read(int(value) + 2)[:-2]
+        if kind == b"*":
+            if int(value) < 0:
+                return None
+            return [self.readReply() for index in range(int(value))]
+        raise ValueError("Unexpected reply from {0}:{1}: {2!r}".format(self.address[0], self.address[1], line))
+
+    # Yields all keys starting with the prefix.
+    def scan(self, prefix):
+        cursor = b"0"
+        while True:
+            cursor, keys = self.execute("SCAN", cursor, "MATCH", prefix + "*", "COUNT", CACHE_BATCH_SIZE)
+            for key in keys:
+                yield key
+            if cursor == b"0":
+                return
+
+    def disconnect(self):
+        if self.socket is not None:
+            self.reader.close()
+            self.socket.close()
+            self.socket = None
+            self.reader = None
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
+
+# The same as TranscriptionCache, but kept on a server speaking the Redis protocol, so that it can be shared by several
+# machines: a word one of them has looked up is a cache hit for all the others. Every word is a key of its own holding the
+# same JSON the SQLite cache stores ("null" for words that weren't found). Entries expire through the server after ttlDays;
+# how many of them are kept is up to the server's memory policy (e.g. maxmemory-policy allkeys-lru).
+class RedisCache:
+    PREFIX = "transcriber:word:"
+    VALIDATORS_PREFIX = "transcriber:validators:"
+
+    def __init__(self, url, ttlDays=CACHE_TTL_DAYS):
+        self.url = url
+        self.ttl = int(ttlDays * 24 * 60 * 60)
+        self.connection = RedisConnection(url)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, word):
+        key = normalizeWord(word)
+        found = self.getMany([key])
+        return key in found, found.get(key)
+
+    # See TranscriptionCache.getMany.
+    def getMany(self, words):
+        keys = list(set(normalizeWord(word) for word in words))
+        found = dict()
+        for start in range(0, len(keys), CACHE_BATCH_SIZE):
+            chunk = keys[start:start + CACHE_BATCH_SIZE]
+            values = self.connection.execute("MGET", *[self.PREFIX + key for key in chunk])
+            for key, value in zip(chunk, values):
+                if value is not None:
+                    found[key] = json.loads(value)
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    # See TranscriptionCache.getEntries. The age of an entry is told by how long it has left until it expires, so without a
+    # TTL, entries are always new. Expired entries are gone.
+    def getEntries(self, words):
+        keys = list(set(normalizeWord(word) for word in words))
+        entries = dict()
+        for start in range(0, len(keys), CACHE_BATCH_SIZE):
+            chunk = keys[start:start + CACHE_BATCH_SIZE]
+            replies = self.connection.pipeline([("MGET",) + tuple(self.PREFIX + key for key in chunk)] + [("TTL", self.PREFIX + key) for key in chunk])
+            for key, value, remaining in zip(chunk, replies[0], replies[1:]):
+                if value is not None:
+                    entries[key] = (json.loads(value), self.ttl - remaining if self.ttl > 0 and remaining >= 0 else 0)
+        return entries
+
+    def getValidators(self, word):
+        value = self.connection.execute("GET", self.VALIDATORS_PREFIX + normalizeWord(word))
+        return None if value is None else json.loads(value)
+
+    def putValidators(self, word, pages):
+        command = ("SET", self.VALIDATORS_PREFIX + normalizeWord(word), json.dumps(pages))
+        self.connection.execute(*(command + ("EX", self.ttl) if self.ttl > 0 else command))
+
+    def put(self, word, data):
+        self.putMany([(word, data)])
+
+    # MSET can't set an expiry time, so the words are set one by one, but in a single pipeline.
+    def putMany(self, items):
+        commands = []
+        for word, data in items:
+            command = ("SET", self.PREFIX + normalizeWord(word), json.dumps(data, ensure_ascii=False))
+            commands.append(command + ("EX", self.ttl) if self.ttl > 0 else command)
+        for start in range(0, len(commands), CACHE_BATCH_SIZE):
+            self.connection.pipeline(commands[start:start + CACHE_BATCH_SIZE])
+
+    def clear(self):
+        for prefix in (self.PREFIX, self.VALIDATORS_PREFIX):
+            for keys in chunked(self.connection.scan(prefix), CACHE_BATCH_SIZE):
+                self.connection.execute("DEL", *keys)
+
+    def info(self):
+        total = 0
+        negative = 0
+        for keys in chunked(self.connection.scan(self.PREFIX), CACHE_BATCH_SIZE):
+            total += len(keys)
+            negative += sum(value == b"null" for value in self.connection.execute("MGET", *keys))
+        return {
+            "server": "{0}:{1}/{2}".format(self.connection.address[0], self.connection.address[1], self.connection.database),
+            "entries": total,
+            "negative": negative,
+            "ttl": "{0} s".format(self.ttl) if self.ttl > 0 else None,
+        }
+
+    def close(self):
+        self.connection.close()
+
+# A compact on-disk index of transcriptions built from lexicon files (see readLexiconFile), memory-mapped for lookups.
+# The file consists of a header (magic, amount of words), a table of record offsets and the records themselves, sorted by
+# the UTF-8 encoding of their word so a word is found by binary search. Every record has the form
+# "word<TAB>pos<TAB>ipa|ipa...[<TAB>pos<TAB>ipa|ipa...]".
+class LexiconIndex:
+    MAGIC = b"TRLEX001"
+    HEADER = struct.Struct("<8sI")
+    OFFSET = struct.Struct("<I")
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            self.map.close()
+            raise ValueError("{0} is not a lexicon index".format(filename))
+        self.offsets = self.HEADER.size
+
+    def record(self, index):
+        start = self.OFFSET.unpack_from(self.map, self.offsets + index * self.OFFSET.size)[0]
+        end = self.OFFSET.unpack_from(self.map, self.offsets + (index + 1) * self.OFFSET.size)[0]
+        return self.map[start:end]
+
+    # Returns the data for the word in the same form getTranscription does, or None if the word isn't in the index.
+    def get(self, word):
+        key = normalizeWord(word).encode() + b"\t"
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            record = self.record(middle)
+            if record[:len(key)] == key:
+                return self.decode(record)
+            elif record < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    @staticmethod
+    def decode(record):
+        fields = record.decode().split("\t")
+        transcriptions = dict()
+        for pos in range(1, len(fields) - 1, 2):
+            transcriptions[fields[pos]] = fields[pos + 1].split("|")
+            # The output code picks a verb's form by its position in the OLD's list of verb forms. A single transcription
+            # is the one of that exact word form, so it takes every position.
+            if fields[pos] == "verb" and len(transcriptions["verb"]) == 1:
+                transcriptions["verb"] = transcriptions["verb"] * 6
+        return [transcriptions]
+
+    # Returns all entries of the index as a dictionary in the form readLexiconFile does.
+    def entries(self):
+        entries = dict()
+        for index in range(self.count):
+            fields = self.record(index).decode().split("\t")
+            entries[fields[0]] = dict()
+            for pos in range(1, len(fields) - 1, 2):
+                entries[fields[0]][fields[pos]] = fields[pos + 1].split("|")
+        return entries
+
+    # Writes the entries to a new index, replacing the file only once it's complete.
+    @staticmethod
+    def build(filename, entries):
+        directory = os.path.dirname(filename)
+        if directory != "" and not os.path.exists(directory):
+            os.makedirs(directory)
+        records = []
+        for word, transcriptions in entries.items():
+            fields = [word]
+            for pos, ipas in transcriptions.items():
+                fields += [pos, "|".join(ipas)]
+            records.append("\t".join(fields).encode())
+        records.sort()
+        offset = LexiconIndex.HEADER.size + (len(records) + 1) * LexiconIndex.OFFSET.size
+        temporary = filename + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(LexiconIndex.HEADER.pack(LexiconIndex.MAGIC, len(records)))
+            for record in records:
+                file.write(LexiconIndex.OFFSET.pack(offset))
+                offset += len(record)
+            file.write(LexiconIndex.OFFSET.pack(offset))
+            for record in records:
+                file.write(record)
+        os.replace(temporary, filename)
+        return len(records)
+
+    def close(self):
+        self.map.close()
+
+# Reads a lexicon file - a CSV (.csv) or TSV (anything else) file with the columns word, part of speech and British IPA.
+# Lines starting with "#" and a header line starting with "word" are ignored. Returns a dictionary of the form
+# {word: {pos: [ipa, ...]}}. Verbs may list all their forms in the order the OLD does, separated by "|".
+def readLexiconFile(filename):
+    entries = dict()
+    with open(filename, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file, delimiter="," if filename.lower().endswith(".csv") else "\t")
+        first = True
+        for row in reader:
+            if len(row) == 0 or row[0].startswith("#"):
+                continue
+            # Only the first row after the comments may be a header - later ones are entries, even the one of the word "word".
+            isHeader = first and row[0].strip().lower() == "word"
+            first = False
+            if len(row) < 3 or isHeader:
+                continue
+            word = normalizeWord(row[0])
+            pos = row[1].strip().lower()
+            ipas = [ipa.strip().strip("/") for ipa in row[2].split("|")]
+            entries.setdefault(word, dict()).setdefault(pos, []).extend(ipas)
+    return entries
+
+# Builds (or, if "update" is set, updates) the lexicon index from the lexicon files. Entries of later files replace the
+# ones of earlier files (and of the existing index), so user overrides should come last.
+def buildLexicon(filename, lexiconFiles, update=False):
+    entries = dict()
+    if update and os.path.exists(filename):
+        index = LexiconIndex(filename)
+        entries = index.entries()
+        index.close()
+    for lexiconFile in lexiconFiles:
+        entries.update(readLexiconFile(lexiconFile))
+    return LexiconIndex.build(filename, entries)
+
+# A page served from the PageStore. Mimics the parts of urllib3's response used by getTranscription.
+class StoredPage:
+    def __init__(self, url, status, data):
+        self.url = url
+        self.status = status
+        self.data = data
+
+    def geturl(self):
+        return self.url
+
+# A compressed, content-addressed store of raw OLD responses. Every body is saved once under its SHA-256 hash,
+# while both the requested URL and the URL it redirected to point to that hash.
+class PageStore:
+    def __init__(self, filename):
+        directory = os.path.dirname(filename)
+        if directory != "" and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.filename = filename
+        # The connection is shared by all worker threads, the lock serializes its use.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS bodies (hash TEXT PRIMARY KEY, body BLOB NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, redirect TEXT, status INTEGER NOT NULL, hash TEXT NOT NULL, fetched REAL NOT NULL)")
+        self.connection.commit()
+
+    def put(self, url, redirectedURL, status, body):
+        digest = hashlib.sha256(body).hexdigest()
+        now = time.time()
+        compressed = zlib.compress(body, 6)
+        with self.lock:
+            self.connection.execute("INSERT OR IGNORE INTO bodies (hash, body) VALUES (?, ?)", (digest, compressed))
+            for key in {url, redirectedURL or url}:
+                self.connection.execute("INSERT OR REPLACE INTO urls (url, redirect, status, hash, fetched) VALUES (?, ?, ?, ?, ?)",
+                                        (key, redirectedURL, status, digest, now))
+            self.connection.commit()
+
+    # Returns a StoredPage for either a requested or a redirected URL, or None if the page hasn't been stored.
+    def get(self, url):
+        with self.lock:
+            row = self.connection.execute("SELECT urls.redirect, urls.status, bodies.body FROM urls JOIN bodies ON urls.hash = bodies.hash WHERE urls.url = ?",
+                                          (url,)).fetchone()
+        if row is None:
+            return None
+        return StoredPage(row[0] or url, row[1], zlib.decompress(row[2]))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+# The same as PageStore, but kept on a server speaking the Redis protocol (see RedisCache). Every URL is a key holding the
+# status, the redirected URL and the compressed body of its page, separated by newlines.
+class RedisPageStore:
+    PREFIX = "transcriber:page:"
+
+    def __init__(self, url):
+        self.url = url
+        self.connection = RedisConnection(url)
+
+    def put(self, url, redirectedURL, status, body):
+        value = b"%d\n%s\n" % (status, (redirectedURL or "").encode()) + zlib.compress(body, 6)
+        self.connection.pipeline([("SET", self.PREFIX + key, value) for key in {url, redirectedURL or url}])
+
+    def get(self, url):
+        value = self.connection.execute("GET", self.PREFIX + url)
+        if value is None:
+            return None
+        status, redirectedURL, compressed = value.split(b"\n", 2)
+        return StoredPage(redirectedURL.decode() or url, int(status), zlib.decompress(compressed))
+
+    def close(self):
+        self.connection.close()
+
+def isRedisURL(location):
+    return location.startswith("redis://")
+
+# Opens the transcription cache at the location - either a SQLite file or the URL of a server speaking the Redis protocol.
+# Both have the same methods: get, getMany, getEntries, put, putMany, getValidators, putValidators, clear, info and close.
+def openCache(location, ttlDays=CACHE_TTL_DAYS, maxEntries=CACHE_MAX_ENTRIES):
+    if isRedisURL(location):
+        return RedisCache(location, ttlDays)
+    return TranscriptionCache(location, ttlDays, maxEntries)
+
+# Opens the page store at the location, see openCache. Both kinds have get, put and close.
+def openPageStore(location):
+    if isRedisURL(location):
+        return RedisPageStore(location)
+    return PageStore(location)
+
+# Counters and latency histograms of a run, shared by all worker threads. Counters may have labels (e.g. the kind of an
+# error), histograms track how long each stage takes - fetch, parse, lookup, complex, word and save.
+class Metrics:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.started = time.time()
+        self.counters = dict()
+        self.histograms = dict()
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram["buckets"][index] += 1
+                    break
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    # Returns the counters and histograms collected so far and starts over, see merge.
+    def drain(self):
+        with self.lock:
+            counters, histograms = self.counters, self.histograms
+            self.counters, self.histograms = dict(), dict()
+        return counters, histograms
+
+    # Adds the counters and histograms drained from another Metrics, e.g. of a worker process.
+    def merge(self, drained):
+        counters, histograms = drained
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for stage, other in histograms.items():
+                histogram = self.histograms.get(stage)
+                if histogram is None:
+                    histogram = self.histograms[stage] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                histogram["buckets"] = [count + otherCount for count, otherCount in zip(histogram["buckets"], other["buckets"])]
+                histogram["sum"] += other["sum"]
+                histogram["count"] += other["count"]
+
+    # Returns the total of a counter over all its labels.
+    def total(self, name):
+        with self.lock:
+            return sum(value for (counterName, labels), value in self.counters.items() if counterName == name)
+
+    # A machine-readable summary of the run. Counters with labels are nested by their label values, histogram buckets are
+    # cumulative, like in Prometheus.
+    def summary(self):
+        elapsed = time.time() - self.started
+        words = self.total("words")
+        lookups = self.total("lookups")
+        with self.lock:
+            counters = dict()
+            for (name, labels), value in sorted(self.counters.items()):
+                if len(labels) == 0:
+                    counters[name] = value
+                else:
+                    counters.setdefault(name, dict())[",".join(labelValue for labelName, labelValue in labels)] = value
+            histograms = dict()
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                buckets = dict()
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                buckets["+Inf"] = histogram["count"]
+                histograms[stage] = {"count": histogram["count"], "sum": round(histogram["sum"], 6), "buckets": buckets}
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "words": words,
+            "words_per_second": round(words / elapsed, 3) if elapsed > 0 else 0,
+            "requests_per_word": round(counters.get("requests", 0) / words, 3) if words > 0 else 0,
+            "not_found_rate": round(counters.get("not_found", 0) / lookups, 3) if lookups > 0 else 0,
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    # The metrics in the Prometheus text exposition format, e.g. for node_exporter's textfile collector.
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((stage, dict(histogram, buckets=list(histogram["buckets"]))) for stage, histogram in self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            metric = METRICS_PREFIX + name + "_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append("# TYPE {0} counter".format(metric))
+            labelText = ",".join('{0}="{1}"'.format(labelName, str(labelValue).replace("\\", "\\\\").replace('"', '\\"')) for labelName, labelValue in labels)
+            lines.append("{0}{1} {2}".format(metric, "{" + labelText + "}" if labelText != "" else "", value))
+        for stage, histogram in histograms:
+            metric = METRICS_PREFIX + stage + "_seconds"
+            lines.append("# TYPE {0} histogram".format(metric))
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                cumulative += count
+                lines.append('{0}_bucket{{le="{1}"}} {2}'.format(metric, bound, cumulative))
+            lines.append('{0}_bucket{{le="+Inf"}} {1}'.format(metric, histogram["count"]))
+            lines.append("{0}_sum {1}".format(metric, histogram["sum"]))
+            lines.append("{0}_count {1}".format(metric, histogram["count"]))
+        return "\n".join(lines) + "\n"
+
+    # Writes the summary as JSON, or in the Prometheus format. The file is replaced at once, so a collector never reads
+    # half of it.
+    def write(self, filename, prometheus=False):
+        temporary = filename + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            if prometheus:
+                file.write(self.prometheus())
+            else:
+                json.dump(self.summary(), file, indent=2)
+        os.replace(temporary, filename)
+
+# The parsed pages of the lemmas fetched during a run, along with the forms of every lemma (plurals, verb forms, comparatives),
+# so that a form can be transcribed from its lemma's page without querying the OLD again. The forms are derived by the
+# regular spelling rules, based on the parts of speech on the page. Words that have been requested and answered with a page
+# are mapped to it as well. Up to LEMMA_STORE_SIZE lemmas are kept, the least recently used one is forgotten first.
+class LemmaStore:
+    def __init__(self, size=LEMMA_STORE_SIZE):
+        self.size = size
+        # The least recently used lemma comes first. Each lemma has its page and the forms that point to it.
+        self.pages = OrderedDict()
+        self.forms = dict()
+        self.lock = threading.Lock()
+
+    def record(self, word, headWord, found):
+        lemma = headWord.strip().lower()
+        if lemma == "" or isComplexWord(lemma):
+            return
+        with self.lock:
+            if lemma in self.pages:
+                self.pages.move_to_end(lemma)
+            else:
+                self.pages[lemma] = (headWord, copyFound(found), set())
+                for form in inflectedForms(lemma, found):
+                    self.addForm(form, lemma, False)
+                if len(self.pages) > self.size:
+                    self.evict()
+            self.addForm(normalizeWord(word), lemma, True)
+            self.addForm(lemma, lemma, False)
+
+    # Points the form to the lemma, unless it points to another one already and "replace" is False. Expects the lock to be held.
+    def addForm(self, form, lemma, replace):
+        if replace or form not in self.forms:
+            self.forms[form] = lemma
+            self.pages[lemma][2].add(form)
+
+    # Forgets the least recently used lemma, along with the forms that still point to it. Expects the lock to be held.
+    def evict(self):
+        lemma, (headWord, found, forms) = self.pages.popitem(last=False)
+        for form in forms:
+            if self.forms.get(form) == lemma:
+                del self.forms[form]
+
+    # Returns a tuple (headWord, found) with a copy of what the parser found on the page of the word's lemma, or None if
+    # the word isn't a known form of any lemma.
+    def get(self, word):
+        with self.lock:
+            lemma = self.forms.get(normalizeWord(word))
+            if lemma is None:
+                return None
+            self.pages.move_to_end(lemma)
+            headWord, found, forms = self.pages[lemma]
+        return headWord, copyFound(found)
+
+# The transcriptions of a page are modified while the result is put together, so stored ones are only handed out as copies.
+def copyFound(found):
+    return {key: list(transcriptions) for key, transcriptions in found.items()}
+
+def endsWithConsonantY(word):
+    return len(word) > 1 and word[-1] == "y" and word[-2] not in "aeiou"
+
+# Consonant-vowel-consonant endings, whose last consonant may be doubled (stop - stopped, big - bigger).
+def endsWithCVC(word):
+    return len(word) > 2 and word[-1] not in "aeiouwxy" and word[-2] in "aeiou" and word[-3] not in "aeiou"
+
+# Returns the regular inflected forms of a lemma for the parts of speech found on its page. Only forms which can't be a form
+# of another spelling are derived: "hoped" could be a form of "hop" or of "hope", so adding -ed, -ing, -er or -est to a lemma
+# as it is never counts (it would also be the form of the lemma with an "e"), and a lemma ending in "e" only has those forms
+# if the lemma without the "e" would double its last consonant instead (hope - hoped, hop - hopped). Other forms are only
+# known once the OLD has redirected them to the lemma, see LemmaStore.record.
+def inflectedForms(lemma, found):
+    forms = set()
+    if "verb" in found or "noun" in found:
+        if lemma.endswith(("s", "x", "z", "ch", "sh", "o")):
+            forms.add(lemma + "es")
+        elif endsWithConsonantY(lemma):
+            forms.add(lemma[:-1] + "ies")
+        else:
+            forms.add(lemma + "s")
+    if "verb" in found:
+        if lemma.endswith(("ie", "ee")):
+            forms.add(lemma + "d")
+            forms.add(lemma[:-2] + "ying" if lemma.endswith("ie") else lemma + "ing")
+        elif lemma.endswith("e"):
+            if endsWithCVC(lemma[:-1]):
+                forms.update([lemma + "d", lemma[:-1] + "ing"])
+        elif endsWithConsonantY(lemma):
+            forms.add(lemma[:-1] + "ied")
+            forms.add(lemma + "ing")
+        elif endsWithCVC(lemma):
+            forms.update([lemma + lemma[-1] + "ed", lemma + lemma[-1] + "ing"])
+    if "adjective" in found:
+        if lemma.endswith("e"):
+            if endsWithCVC(lemma[:-1]):
+                forms.update([lemma + "r", lemma + "st"])
+        elif endsWithConsonantY(lemma):
+            forms.update([lemma[:-1] + "ier", lemma[:-1] + "iest"])
+        elif endsWithCVC(lemma):
+            forms.update([lemma + lemma[-1] + "er", lemma + lemma[-1] + "est"])
+    forms.discard(lemma)
+    return forms
+
+# Returns the kind of a lookup error for the metrics - an HTTP status or the type of an exception.
+def errorKind(error):
+    if isinstance(error, int):
+        return "http_" + str(error)
+    return type(error).__name__
+
+# An append-only log of the results of the rows of an input, one JSON line per row, so an interrupted run can be resumed
+# where it stopped. Every line is flushed as soon as it's written. A row is identified by its index and its word - if the
+# input changed since, the row is transcribed again. Rows which failed are transcribed again as well.
+class Journal:
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.results = dict()
+        needsNewline = False
+        if resume and os.path.exists(filename):
+            with open(filename, "r", encoding="utf-8") as file:
+                for line in file:
+                    needsNewline = not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last line may have been cut short by the interruption.
+                        continue
+                    if record["error"] is None:
+                        self.results[record["row"]] = (record["word"], record["result"])
+                    else:
+                        self.results.pop(record["row"], None)
+        self.file = open(filename, "a" if resume else "w", encoding="utf-8")
+        if needsNewline:
+            self.file.write("\n")
+        if VERBOSE_DEBUG and resume: print ("[*] [DEBUG] Resuming with", len(self.results), "row(s) from", filename)
+
+    # Returns the journaled result of the row, or None if it has to be transcribed.
+    def recorded(self, row, word):
+        entry = self.results.get(row)
+        if entry is None or entry[0] != word:
+            return None
+        isComplex, result = entry[1]
+        return isComplex, result if isComplex else Transcription.fromData(word, result)
+
+    def record(self, row, word, transcribed=None, error=None):
+        if transcribed is not None:
+            isComplex, result = transcribed
+            transcribed = [isComplex, result if isComplex or result is None else result.toData()]
+        self.file.write(json.dumps({"row": row, "word": word, "result": transcribed, "error": error}, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    # Closes and deletes the journal - once the output is written, it's not needed anymore.
+    def remove(self):
+        self.close()
+        os.remove(self.filename)
+
+# The results of the entries of a plaintext input from its previous run, so that running the script on it again only
+# transcribes the entries which are new or have changed. An entry is identified by a hash of its (normalized) word rather than
+# its position, so adding or removing lines doesn't affect the others. The manifest is a JSON line per entry and is written
+# anew by save, with the entries of the current run only. Entries which failed aren't kept, so they're transcribed again.
+class Manifest:
+    def __init__(self, filename):
+        self.filename = filename
+        self.previous = dict()
+        self.current = dict()
+        if os.path.exists(filename):
+            with open(filename, "r", encoding="utf-8") as file:
+                for line in file:
+                    record = json.loads(line)
+                    self.previous[record["hash"]] = record["result"]
+        if VERBOSE_DEBUG: print ("[*] [DEBUG] Loaded", len(self.previous), "entries from the manifest", filename)
+
+    # Words which only differ in case or quotes are the same entry.
+    @staticmethod
+    def hash(word):
+        return hashlib.blake2b(normalizeWord(word).encode(), digest_size=16).hexdigest()
+
+    # Returns the result of the word from the previous run, or None if it has to be transcribed.
+    def recorded(self, word):
+        entry = self.previous.get(self.hash(word))
+        if entry is None:
+            return None
+        isComplex, result = entry
+        return isComplex, result if isComplex else Transcription.fromData(word, result)
+
+    def record(self, word, transcribed):
+        isComplex, result = transcribed
+        self.current[self.hash(word)] = [isComplex, result if isComplex or result is None else result.toData()]
+
+    # Writes the entries of the current run, unless they're the same as the previous ones.
+    def save(self):
+        if self.current.keys() == self.previous.keys():
+            return
+        with open(self.filename + ".tmp", "w", encoding="utf-8") as file:
+            for key, result in self.current.items():
+                file.write(json.dumps({"hash": key, "result": result}, ensure_ascii=False) + "\n")
+        os.replace(self.filename + ".tmp", self.filename)
+
+# A token bucket that limits the rate of requests across all worker threads. Every request takes a token, tokens are
+# refilled at "rate" per second up to "burst". If there is no token left, the caller waits for its turn.
+class RateLimiter:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve a token even if there is none yet, so waiting threads are served in order.
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+class CircuitOpenError(Exception):
+    pass
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+# Stops sending requests to the OLD while it's unhealthy. After "failures" failed requests in a row (errors, or transient
+# statuses which are still there after retrying) the circuit opens and every request fails right away. After "reset"
+# seconds, a single request is let through - if it succeeds, the circuit closes again, otherwise it stays open.
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self.failed = 0
+        self.openedAt = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def check(self):
+        if self.failures <= 0:
+            return
+        with self.lock:
+            if self.openedAt is None:
+                return
+            if not self.probing and time.monotonic() - self.openedAt >= self.reset:
+                if VERBOSE_DEBUG: print ("[*] [DEBUG] Probing whether the OLD has recovered")
+                self.probing = True
+                return
+        raise CircuitOpenError("The OLD seems to be unavailable - not sending requests for now")
+
+    def succeeded(self):
+        with self.lock:
+            if self.openedAt is not None and VERBOSE_DEBUG: print ("[*] [DEBUG] The OLD has recovered, closing the circuit")
+            self.failed = 0
+            self.openedAt = None
+            self.probing = False
+
+    def fail(self):
+        if self.failures <= 0:
+            return
+        with self.lock:
+            self.failed += 1
+            if self.probing or self.failed >= self.failures:
+                if VERBOSE_DEBUG and (self.openedAt is None or self.probing): print ("[*] [DEBUG] Opening the circuit after", self.failed, "failed request(s)")
+                self.openedAt = time.monotonic()
+                self.probing = False
+
+# A client that keeps a pool of persistent connections to the OLD, accepts compressed responses, retries transient
+# failures with exponential backoff and respects the global rate limit. Every request is bounded by "timeout" and goes
+# through the circuit breaker. If hedge is set, a request which takes longer than most recent ones (see HEDGE_PERCENTILE)
+# is sent once more and whichever response comes first is used.
+class HttpClient:
+    def __init__(self, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF, rate=HTTP_RATE_LIMIT, burst=HTTP_BURST, connections=1,
+                 timeout=HTTP_TIMEOUT, hedge=False, hedgePercentile=HEDGE_PERCENTILE, breakerFailures=BREAKER_FAILURES,
+                 breakerReset=BREAKER_RESET):
+        import urllib3
+        # Only transient failures count as retries, redirects have a budget of their own. Both are followed by send, not by
+        # urllib3, so that every attempt is counted by the rate limiter.
+        self.retry = urllib3.Retry(total=None, connect=retries, read=retries, status=retries, other=retries, redirect=HTTP_MAX_REDIRECTS,
+                                   backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                                   allowed_methods=["GET"], respect_retry_after_header=True, raise_on_status=False)
+        self.limiter = RateLimiter(rate, burst)
+        self.breaker = CircuitBreaker(breakerFailures, breakerReset)
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedgePercentile = hedgePercentile
+        self.latencies = deque(maxlen=HEDGE_WINDOW)
+        self.hedgePool = ThreadPoolExecutor(max_workers=max(connections, 1) * 2) if hedge else None
+        headers = urllib3.make_headers(accept_encoding=True, keep_alive=True)
+        # Hedged requests need a connection of their own.
+        self.pool = urllib3.PoolManager(maxsize=max(connections, 1) * (2 if hedge else 1), headers=headers, retries=False)
+
+    # If stream is set, the body is not read - the caller has to read it and release the connection. The timeout is
+    # lowered to "timeout", if given (e.g. because the deadline of the word is closer). "headers" are sent along with the
+    # default ones.
+    def request(self, URL, stream=False, timeout=None, headers=None):
+        self.breaker.check()
+        if self.timeout > 0:
+            timeout = self.timeout if timeout is None else min(self.timeout, timeout)
+        try:
+            if self.hedge and not stream:
+                response = self.hedgedRequest(URL, timeout, headers)
+            else:
+                response = self.send(URL, stream, timeout, headers)
+        except Exception:
+            self.breaker.fail()
+            raise
+        if response.status in RETRY_STATUSES:
+            self.breaker.fail()
+        else:
+            self.breaker.succeeded()
+        return response
+
+    # Sends the request, following redirects and retrying transient failures (with the backoff of self.retry) one attempt
+    # at a time, so that each of them takes a token from the rate limiter. Like with urllib3's own retries, the response has
+    # the Retry with the history of the attempts as "retries", and once the retries are used up, the last response is
+    # returned as it is.
+    def send(self, URL, stream=False, timeout=None, headers=None):
+        from urllib.parse import urljoin
+        from urllib3.exceptions import HTTPError, MaxRetryError
+        if headers is not None:
+            headers = dict(self.pool.headers, **headers)
+        retry = self.retry.new()
+        start = time.monotonic()
+        while True:
+            self.limiter.acquire()
+            try:
+                response = self.pool.request("GET", URL, preload_content=not stream, timeout=timeout, headers=headers, redirect=False, retries=False)
+            except HTTPError as e:
+                retry = retry.increment("GET", URL, error=e)
+                retry.sleep()
+                continue
+            location = response.get_redirect_location()
+            if not location and not retry.is_retry("GET", response.status, "Retry-After" in response.headers):
+                break
+            try:
+                retry = retry.increment("GET", URL, response=response)
+            except MaxRetryError:
+                if location:
+                    raise
+                break
+            response.drain_conn()
+            response.release_conn()
+            if location:
+                URL = urljoin(URL, location)
+            else:
+                retry.sleep(response)
+        self.latencies.append(time.monotonic() - start)
+        response.retries = retry
+        return response
+
+    # Returns how long to wait for a response before hedging, or None while there are too few recent requests to tell.
+    def hedgeDelay(self):
+        latencies = sorted(self.latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, len(latencies) * self.hedgePercentile // 100)]
+
+    def hedgedRequest(self, URL, timeout, headers=None):
+        delay = self.hedgeDelay()
+        if delay is None:
+            return self.send(URL, False, timeout, headers)
+        first = self.hedgePool.submit(self.send, URL, False, timeout, headers)
+        if len(wait([first], timeout=delay).done) > 0:
+            return first.result()
+        if VERBOSE_DEBUG: print ("[*] [DEBUG] No response after", round(delay, 3), "s, hedging", URL)
+        second = self.hedgePool.submit(self.send, URL, False, timeout, headers)
+        done, pending = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        # If the faster one failed, the other one might still succeed.
+        if winner.exception() is not None and len(pending) > 0:
+            winner = pending.pop()
+        response = winner.result()
+        response.hedged = True
+        return response
+
+    def close(self):
+        if self.hedgePool is not None:
+            self.hedgePool.shutdown(wait=False)
+        self.pool.clear()
+
 def syllableCount(word):
     count = 0
     if word[0] in VOWELS:
@@ -246,297 +1467,1481 @@ def getPluralOrThirdPerson(type, word, items):
             
     return items
 
-def getTranscription(wordToTranscribe, wordType=None):
-    data = []
-    word = wordToTranscribe
-
-    prefix_re = False
-    prefix_un = False
-    prefix_out = False
-    prefix_mis = False
-    prefix_pre = False
-    prefix_over = False
-    prefix_under = False
-    prefix_de = False
-    prefix = ""
-    prefixExists = False
-    prefixIterations = 1
-    
-    if word[:5] == "under":
-        prefix_under = True
-        prefixIterations = 2
-        prefix = "under"
-
-    elif word[:2] == "re":
-        prefix_re = True
-        prefixIterations = 2
-        prefix = "re"
-
-    elif word[:2] == "un":
-        prefix_un = True
-        prefixIterations = 2
-        prefix = "un"
-        
-    elif word[:3] == "out":
-        prefix_out = True
-        prefixIterations = 2
-        prefix = "out"
-
-    elif word[:3] == "mis":
-        prefix_mis = True
-        prefixIterations = 2
-        prefix = "mis"
-
-    elif word[:3] == "pre":
-        prefix_pre = True
-        prefixIterations = 2
-        prefix = "pre"
-
-    elif word[:4] == "over":
-        prefix_over = True
-        prefixIterations = 2
-        prefix = "over"   
-
-    elif word[:2] == "de":
-        prefix_de = True
-        prefixIterations = 2
-        prefix = "de" 
-
-    for prefixIteration in range(prefixIterations):
-        # If this is the second iteration, this means that the original word has a prefix and a match for the prefixed word
-        # hasn't been found - therefore, remove the prefix and try adding it manually later.
-        # This is needed in some cases where it might seem like there is a prefix but there actually isn't one,
-        # for example "outside" 
-        if prefixIteration == 1:
-            # word = prefix + word
-            if prefix_re or prefix_un or prefix_de:
-                word = word[2:]
-
-            elif prefix_out or prefix_mis or prefix_pre:
-                word = word[3:]
-
-            elif prefix_over:
-                word = word[4:]
-
-            elif prefix_under:
-                word = word[5:]
+# Normalizes a word the same way the main loops do before transcribing it.
+def normalizeWord(word):
+    return word.strip(CHARACTERS_TO_STRIP).replace("’", "'").lower()
+
+# A trie of affixes, used to find all affixes a word starts with (or, if reverse is set, ends with) in a single pass
+# over the word.
+class AffixTrie:
+    def __init__(self, affixes, reverse=False):
+        self.reverse = reverse
+        self.root = dict()
+        for affix in affixes:
+            node = self.root
+            for char in (affix[::-1] if reverse else affix):
+                node = node.setdefault(char, dict())
+            # The None key marks the end of an affix.
+            node[None] = affix
+
+    # Returns the matching affixes, shortest first.
+    def matches(self, word):
+        found = []
+        node = self.root
+        for char in (reversed(word) if self.reverse else word):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                found.append(node[None])
+        return found
+
+PREFIX_TRIE = AffixTrie(PREFIX_TRANSCRIPTIONS)
+SUFFIX_TRIE = AffixTrie(SUFFIX_RULES, reverse=True)
+
+# Returns the longest prefix the word starts with (see PREFIX_TRANSCRIPTIONS) or an empty string if there is none.
+def findPrefix(word):
+    prefixes = PREFIX_TRIE.matches(word)
+    if len(prefixes) == 0:
+        return ""
+    return prefixes[-1]
+
+# Returns the properties of all suffixes the word ends with (see SUFFIX_RULES). "possessive" and "retry" are set to the
+# suffix they come from, so it can be removed from the word.
+def classifySuffixes(word):
+    properties = dict()
+    for suffix in SUFFIX_TRIE.matches(word):
+        rule = SUFFIX_RULES[suffix]
+        properties.update(rule)
+        for name in ("possessive", "retry"):
+            if name in rule:
+                properties[name] = suffix
+    return properties
+
+def stripSuffix(word, suffix):
+    return word[:-len(suffix)]
+
+# Returns the suffix from the properties that may be retried only once, if there is one.
+def onceRetry(suffixes):
+    retry = suffixes.get("retry")
+    if retry is not None and not SUFFIX_RULES[retry].get("repeat", False):
+        return retry
+    return None
+
+# Returns the suffix to remove from a word that hasn't been found, or None if there is nothing left to try. Suffixes that
+# may be retried repeatedly take precedence over the pending one-time retry.
+def nextRetry(word, pendingRetry):
+    retry = classifySuffixes(word).get("retry")
+    if retry is not None and SUFFIX_RULES[retry].get("repeat", False):
+        return retry
+    return pendingRetry
+
+# Appends the transcription of a suffix that has been removed from the word to the transcriptions found for the rest.
+def appendRetryTranscription(items, suffix):
+    rule = SUFFIX_RULES[suffix]
+    for key in items:
+        if rule.get("retryPos", key) == key:
+            for i in range(len(items[key])):
+                items[key][i] += rule["retry"]
+
+# Returns the transcriptions to use for a verb, based on the verb forms (as listed by the OLD) and the word's suffix.
+def selectVerbForm(word, verbForms):
+    verbForm = classifySuffixes(word).get("verbForm", 1)
+    if verbForm == "ing":
+        if syllableCount(word) == 1:
+            return [verbForms[0]]
+        elif verbForms[-1][-2:] == "ɪŋ":
+            return [verbForms[-1]]
+        elif verbForms[-2][-2:] == "ɪŋ":
+            return [verbForms[-2]]
+        else:
+            return [transcription for transcription in verbForms if transcription[-2:] == "ɪŋ"]
+    return [verbForms[verbForm]]
+
+# Returns all forms of the word lookupTranscription might request from the OLD, in the order it requests them: the word
+# itself, then the word with the trailing "s", "ly" or "er" removed, and the same for the word without its prefix.
+# Which of them are actually requested depends on the responses, which is why they're only candidates.
+def candidateForms(word):
+    prefix = findPrefix(word)
+    stems = [word] if prefix == "" else [word, word[len(prefix):]]
+    candidates = []
+    for stem in stems:
+        # Irregular verbs and contractions are transcribed locally and end the lookup.
+        if stem in IRREGULAR_VERBS or stem in CONTRACTIONS:
+            break
+        suffixes = classifySuffixes(stem)
+        if "possessive" in suffixes:
+            stem = stripSuffix(stem, suffixes["possessive"])
+            suffixes = classifySuffixes(stem)
+        pendingRetry = onceRetry(suffixes)
+        while True:
+            candidates.append(stem)
+            retry = nextRetry(stem, pendingRetry)
+            if retry is None:
+                break
+            if retry == pendingRetry:
+                pendingRetry = None
+            stem = stripSuffix(stem, retry)
+    return candidates
+
+# The transcriptions of a word for one part of speech. "chosen" are the ones that are output - for verbs, the form that
+# matches the word (see selectVerbForm), picked once when the entry is created, otherwise all variants. The strings are
+# interned, so the same transcription or part of speech is only kept in memory once however many words share it.
+class Entry:
+    __slots__ = ("pos", "variants", "chosen")
+
+    def __init__(self, word, pos, variants):
+        self.pos = sys.intern(pos)
+        self.variants = tuple(sys.intern(variant) if isinstance(variant, str) else variant for variant in variants)
+        self.chosen = self.variants
+        if self.pos == "verb":
+            try:
+                self.chosen = tuple(selectVerbForm(word, self.variants))
+            except Exception:
+                # The verb form is picked again (and fails the same way) when the entry is output.
+                self.chosen = None
+
+    def forms(self, word):
+        if self.chosen is None:
+            return selectVerbForm(word, self.variants)
+        return self.chosen
+
+# What getTranscription returns for a word that has been found: groups of entries, one group for each page (or other
+# source) the transcriptions came from, in order. Iterating over it yields the groups. toData and fromData convert it
+# from and to the lists of dictionaries (part of speech -> transcriptions) it's stored as in the cache, lexicon and journal.
+class Transcription:
+    __slots__ = ("groups",)
+
+    def __init__(self, groups):
+        self.groups = groups
+
+    @staticmethod
+    def fromData(word, data):
+        if data is None:
+            return None
+        word = word.lower()
+        return Transcription(tuple(tuple(Entry(word, pos, variants) for pos, variants in dictionary.items()) for dictionary in data))
+
+    def toData(self):
+        return [{entry.pos: list(entry.variants) for entry in group} for group in self.groups]
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __repr__(self):
+        return "Transcription(" + repr(self.toData()) + ")"
+
+    # Returns the first transcription, or None if there is none.
+    def first(self):
+        for group in self.groups:
+            for entry in group:
+                for variant in entry.variants:
+                    return variant
+        return None
+
+# Returns the first transcription of what getTranscription returned, or None if there is none.
+def firstTranscription(data):
+    if (data != None):
+        return data.first()
+    return None
+
+def isComplexWord(word):
+    for separator in WORD_SEPARATORS:
+        if separator in word:
+            return True
+    return False
+
+# Splits a complex word into the words it consists of.
+def splitComplexWord(wordsCombination):
+    return split(" |-|—|/|[|]", wordsCombination)
+
+# The amount of requests a Transcriber may send at once - every job may look up the parts of a complex word alongside the
+# word itself, and each of those lookups may request several candidate forms when speculating.
+def connectionCount(jobs, speculate):
+    return max(jobs, 1) * (1 + PHRASE_WIDTH) * (SPECULATION_WIDTH if speculate else 1)
+
+# Transcribes words and holds everything that is shared between lookups: the HTTP client, the cache, the lexicon, the page
+# store and the results of the planning phase. All of them are optional - a plain Transcriber() queries the OLD for every
+# word. A Transcriber may be used from several threads at once.
+#   jobs      - amount of words transcribed concurrently by transcribeAll and transcribe_futures
+#   cache     - a TranscriptionCache or RedisCache, see openCache
+#   lexicon   - a LexiconIndex
+#   pageStore - a PageStore or RedisPageStore the fetched pages are saved to or, with reparse set, read from instead of the OLD
+#   stream    - parse pages while they're being downloaded, see feedPage
+#   speculate - request all candidate forms of a word at once, see prefetchCandidates
+#   http      - the HttpClient to use, created with the default settings when it's needed if not given
+#   baseURL   - the search URL of the OLD, the module's baseURL at the time the Transcriber is created if not given
+class Transcriber:
+    def __init__(self, jobs=JOBS, cache=None, lexicon=None, pageStore=None, reparse=False, stream=False, speculate=False,
+                 http=None, baseURL=None, metrics=None, lemmas=False, deadline=WORD_DEADLINE):
+        self.jobs = max(jobs, 1)
+        self.cache = cache
+        self.lexicon = lexicon
+        self.pageStore = pageStore
+        self.reparse = reparse
+        self.stream = stream
+        self.speculate = speculate
+        self.http = http
+        # The parameter hides the module's baseURL, which may have been changed since this was defined.
+        self.baseURL = baseURL if baseURL is not None else globals()["baseURL"]
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.lemmas = LemmaStore() if lemmas else None
+        self.deadline = deadline
+        # The deadline of the word the current thread is working on (see transcribeWord) and, while warming the cache, the
+        # validators of the pages requested for it (see recordValidators).
+        self.local = threading.local()
+        # Results of the lookups resolved by the planning phase, keyed by the normalized word.
+        self.lookupMemo = dict()
+        # Futures of the lookups in progress, keyed by the normalized word and its type.
+        self.inflight = dict()
+        self.speculationPool = None
+        # Results of the parts of complex words, least recently used first, and the pool that looks them up.
+        self.partMemo = OrderedDict()
+        self.phrasePool = None
+        # The words read from the cache and the results waiting to be written to it while in a cacheBatch.
+        self.batch = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # Closes everything the transcriber holds, including the cache, lexicon and page store it has been given.
+    def close(self):
+        for resource in (self.cache, self.pageStore, self.lexicon, self.http):
+            if resource is not None:
+                resource.close()
+        for pool in (self.speculationPool, self.phrasePool):
+            if pool is not None:
+                pool.shutdown()
+
+    # Returns the HTTP client, creating it with the default settings if it doesn't exist yet.
+    def getHttpClient(self):
+        with self.lock:
+            if self.http is None:
+                self.http = HttpClient(connections=connectionCount(self.jobs, self.speculate))
+            return self.http
+
+    # Transcribes a single word (or complex word) the same way the script does for every line of its input. Returns a
+    # tuple (isComplex, result), see transcribeWord.
+    def transcribe(self, word):
+        return self.transcribeWord(word.strip(CHARACTERS_TO_STRIP).replace("’", "'"))
+
+    # Transcribes all the words concurrently and yields tuples (word, future) as soon as each of them is done - not
+    # necessarily in the same order as the words. The futures are done already: their result is what transcribe returns,
+    # and a word that couldn't be transcribed raises its error from future.result() without stopping the others.
+    def transcribe_futures(self, words):
+        words = [word.strip(CHARACTERS_TO_STRIP).replace("’", "'") for word in words]
+        return self.transcribeAll(words, ordered=False)
+
+    # Requests the URL from the OLD, saving the response in the page store if there is one. In reparse mode the page
+    # is taken from the store instead and the network is never used. Pages already requested by prefetchCandidates are
+    # taken from "pages".
+    def fetchPage(self, http, URL, pages=None):
+        if pages is not None and URL in pages:
+            return pages[URL].result()
+        if self.reparse:
+            page = self.pageStore.get(URL)
+            if page is None:
+                raise LookupError("No stored page for " + URL)
+            return page
+        if self.isStreaming():
+            response = self.requestPage(http, URL, stream=True)
+            # Only pages that will be parsed are streamed.
+            if response.status != 200:
+                response.data
+                response.release_conn()
+            return response
+        response = self.requestPage(http, URL)
+        if self.pageStore is not None and response.status in (200, 404):
+            self.pageStore.put(URL, response.geturl(), response.status, response.data)
+        return response
+
+    # Sends a request to the OLD and counts it, along with the redirects and retries it took and its status. Each of those is
+    # a request of its own.
+    def requestPage(self, http, URL, stream=False, headers=None):
+        deadline = getattr(self.local, "deadline", None)
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded("The word took longer than {0} s".format(self.deadline))
+        with self.metrics.timed("fetch"):
+            response = http.request(URL, stream=stream, timeout=remaining, headers=headers)
+        if getattr(response, "hedged", False):
+            self.metrics.count("hedged_requests")
+        pages = getattr(self.local, "validators", None)
+        if pages is not None and response.status == 200:
+            validators = pageValidators(response)
+            if validators is not None:
+                with self.lock:
+                    pages[URL] = validators
+        history = response.retries.history if response.retries is not None else ()
+        redirects = len([attempt for attempt in history if attempt.redirect_location is not None])
+        self.metrics.count("requests", 1 + len(history))
+        self.metrics.count("responses", status=str(response.status))
+        if redirects > 0:
+            self.metrics.count("redirects", redirects)
+        if len(history) > redirects:
+            self.metrics.count("http_retries", len(history) - redirects)
+        return response
+
+    # Pages are streamed only if they're fetched from the network and there's no need to store them as a whole.
+    # Speculatively requested pages are read as a whole as well, since they might never be parsed.
+    def isStreaming(self):
+        return self.stream and not self.reparse and not self.speculate and self.pageStore is None
+
+    # Feeds a page returned by fetchPage to the parser. Streamed pages are decoded and parsed chunk by chunk, and reading
+    # stops as soon as the parser is complete.
+    def feedPage(self, parser, response):
+        with self.metrics.timed("parse"):
+            self.readPage(parser, response)
+
+    def readPage(self, parser, response):
+        if not self.isStreaming():
+            parser.feed(response.data.decode())
+            return
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        received = 0
+        try:
+            for chunk in response.stream(STREAM_CHUNK_SIZE):
+                received += len(chunk)
+                parser.feed(decoder.decode(chunk))
+                if parser.complete:
+                    if VERBOSE_DEBUG: print ("[*] [DEBUG] Stopped reading after", received, "bytes")
+                    break
+            else:
+                parser.feed(decoder.decode(b"", final=True))
+        finally:
+            remaining = response.length_remaining
+            if parser.complete and (remaining is None or remaining > STREAM_DRAIN_LIMIT):
+                response.close()
+            else:
+                response.drain_conn()
+            response.release_conn()
+
+    # Looks the word up in the lexicon and the cache first and only queries the OLD on a miss. Results of lookups that failed
+    # because of an error (as opposed to the word not being found) are not cached.
+    def getTranscription(self, wordToTranscribe, wordType=None):
+        # Lookups resolved by the planning phase (see resolveLookups) are served from memory.
+        future = self.lookupMemo.get(normalizeWord(wordToTranscribe))
+        if future is not None:
+            self.metrics.count("lookups", source="memo")
+            return future.result()
+        # Concurrent lookups of the same word (by other jobs, or other clients of the service) wait for the one that's already
+        # in flight instead of querying the OLD again.
+        key = (normalizeWord(wordToTranscribe), wordType)
+        with self.lock:
+            future = self.inflight.get(key)
+            isOwner = future is None
+            if isOwner:
+                future = self.inflight[key] = Future()
+        if not isOwner:
+            self.metrics.count("lookups", source="coalesced")
+            return future.result()
+        try:
+            data = self.resolveTranscription(wordToTranscribe, wordType)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+    def resolveTranscription(self, wordToTranscribe, wordType=None):
+        return Transcription.fromData(wordToTranscribe, self.resolveData(wordToTranscribe, wordType))
+
+    # Returns the transcriptions of the word as lists of dictionaries, the way the lexicon, the cache and the lookup have them.
+    # If useCache isn't set, the word is looked up even if it's cached, and the cached result is replaced.
+    def resolveData(self, wordToTranscribe, wordType=None, useCache=True):
+        if self.lexicon is not None:
+            data = self.lexicon.get(wordToTranscribe)
+            if data is not None:
+                if VERBOSE_DEBUG: print ("[*] [DEBUG] Found", wordToTranscribe, "in the lexicon")
+                self.metrics.count("lookups", source="lexicon")
+                return data
+        # When reparsing, cached results are what we want to replace, so only write to the cache.
+        if self.cache is not None and not self.reparse and useCache:
+            found, data = self.cachedData(wordToTranscribe)
+            if found:
+                if VERBOSE_DEBUG: print ("[*] [DEBUG] Cache hit for", wordToTranscribe)
+                self.metrics.count("cache_hits")
+                self.metrics.count("lookups", source="cache")
+                if data is None:
+                    self.metrics.count("not_found")
+                return data
+            self.metrics.count("cache_misses")
+        lookupErrors = []
+        with self.metrics.timed("lookup"):
+            data = self.lookupTranscription(wordToTranscribe, wordType, lookupErrors)
+        self.metrics.count("lookups", source="old")
+        # A word that couldn't be looked up because of an error is an error, not a word that doesn't exist.
+        if data is None and len(lookupErrors) > 0:
+            error = lookupErrors[-1]
+            if isinstance(error, int):
+                error = LookupError("The OLD returned HTTP {0}".format(error))
+            raise error
+        for error in lookupErrors:
+            self.metrics.count("errors", kind=errorKind(error))
+        if data is None:
+            self.metrics.count("not_found")
+        if self.cache is not None and len(lookupErrors) == 0:
+            self.cacheData(wordToTranscribe, data)
+        return data
+
+    # Reads the cached results of all the words with a single request to the cache and holds back the results written to it
+    # until the block ends (or CACHE_BATCH_SIZE of them are waiting), when they're written with a single request as well. With
+    # a shared cache every request is a round trip, and every result that's written is served to the other machines. Blocks
+    # may be nested - words the outer ones have read aren't read again, and the outermost one writes the remaining results.
+    @contextmanager
+    def cacheBatch(self, words):
+        if self.cache is None:
+            yield
+            return
+        with self.lock:
+            outermost = self.batch is None
+            if outermost:
+                self.batch = {"read": set(), "found": dict(), "writes": dict()}
+            keys = set(normalizeWord(word) for word in words if word is not None) - self.batch["read"]
+        try:
+            found = dict() if self.reparse or len(keys) == 0 else self.readCache(keys)
+            with self.lock:
+                self.batch["read"].update(keys)
+                self.batch["found"].update(found)
+            yield
+        finally:
+            if outermost:
+                with self.lock:
+                    batch, self.batch = self.batch, None
+                if len(batch["writes"]) > 0:
+                    self.writeCache(list(batch["writes"].items()))
+
+    # Calls the function and keeps the validators of every page it requested (itself or on its behalf) in the cache, as the
+    # validators of the word, so that revalidate can check them later. Returns what the function returns.
+    def recordValidators(self, word, function, *args):
+        pages = self.local.validators = dict()
+        try:
+            result = function(*args)
+        finally:
+            self.local.validators = None
+        if len(pages) > 0:
+            self.cache.putValidators(word, pages)
+        return result
+
+    # Checks whether the cached data of the word is still what the OLD has, see warmCache. Every page the word was looked up
+    # from is requested again with its validators - if none of them has changed, the data is kept and "revalidated" returned.
+    # Otherwise the word is looked up again, which requests the changed page once more, and "changed" is returned if its
+    # transcriptions are different now.
+    def revalidate(self, word, data):
+        key = normalizeWord(word)
+        pages = self.cache.getValidators(key)
+        if pages is not None and all(self.pageUnchanged(URL, validators) for URL, validators in pages.items()):
+            self.cacheData(key, data)
+            return "revalidated"
+        refreshed = self.recordValidators(key, self.resolveData, key, None, False)
+        # The cached data has been through JSON, so the new data has to be as well to compare them.
+        if json.loads(json.dumps(refreshed)) == data:
+            return "revalidated"
+        return "changed"
+
+    # Sends a conditional request for the page, which the OLD answers with HTTP 304 if it hasn't changed.
+    def pageUnchanged(self, URL, validators):
+        headers = dict()
+        if validators.get("etag") is not None:
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("modified") is not None:
+            headers["If-Modified-Since"] = validators["modified"]
+        return self.requestPage(self.getHttpClient(), URL, headers=headers).status == 304
+
+    # The same as cache.get, but words read by cacheBatch are taken from the batch.
+    def cachedData(self, word):
+        key = normalizeWord(word)
+        with self.lock:
+            batch = self.batch
+            if batch is not None and key in batch["read"]:
+                return key in batch["found"], batch["found"].get(key)
+        return self.cache.get(word)
+
+    # The same as cache.put, but within a cacheBatch the data is written later, together with the other results.
+    def cacheData(self, word, data):
+        writes = None
+        with self.lock:
+            if self.batch is None:
+                writes = [(word, data)]
+            else:
+                self.batch["writes"][normalizeWord(word)] = data
+                if len(self.batch["writes"]) >= CACHE_BATCH_SIZE:
+                    writes = list(self.batch["writes"].items())
+                    self.batch["writes"] = dict()
+        if writes is not None:
+            self.writeCache(writes)
+
+    # The same as cache.getMany, but a cache that can't be read from counts as one that has none of the words - like
+    # writeCache, it's counted, not raised.
+    def readCache(self, words):
+        try:
+            return self.cache.getMany(words)
+        except Exception as e:
+            self.metrics.count("cache_errors", kind=errorKind(e))
+            if VERBOSE_DEBUG: print ("[*] [DEBUG] Couldn't read", len(words), "word(s) from the cache:", e)
+            return dict()
+
+    # Caches the data of the words, given as tuples (word, data). The words are transcribed either way, so failing to write
+    # them (a locked database, a full disk, an unreachable Redis server) only costs the cache entries - it's counted, not raised.
+    def writeCache(self, items):
+        try:
+            self.cache.putMany(items)
+        except Exception as e:
+            self.metrics.count("cache_errors", kind=errorKind(e))
+            if VERBOSE_DEBUG: print ("[*] [DEBUG] Couldn't write", len(items), "word(s) to the cache:", e)
+
+    # Starts requesting every candidate form of the word concurrently. Returns a dictionary of futures keyed by URL, which
+    # fetchPage takes the pages from.
+    def prefetchCandidates(self, word):
+        with self.lock:
+            if self.speculationPool is None:
+                self.speculationPool = ThreadPoolExecutor(max_workers=self.jobs * SPECULATION_WIDTH)
+        http = self.getHttpClient()
+        pages = dict()
+        for candidate in candidateForms(word):
+            URL = self.baseURL + candidate.strip()
+            if self.lemmas is not None and self.lemmas.get(candidate) is not None:
+                continue
+            if URL not in pages:
+                pages[URL] = self.speculationPool.submit(self.onBehalf(self.fetchPage), http, URL)
+        if VERBOSE_DEBUG: print ("[*] [DEBUG] Speculatively requesting", list(pages))
+        return pages
+
+    def lookupTranscription(self, wordToTranscribe, wordType=None, lookupErrors=None):
+        if lookupErrors is None:
+            lookupErrors = []
+        data = []
+        word = wordToTranscribe
+
+        prefix = findPrefix(word)
+        prefixIterations = 1 if prefix == "" else 2
+
+        # When speculating, all forms of the word that might be needed are requested at once. The lookup below still goes
+        # through them one by one, but the pages are already there (or on their way).
+        pages = self.prefetchCandidates(word) if self.speculate else None
+
+        for prefixIteration in range(prefixIterations):
+            # If this is the second iteration, this means that the original word has a prefix and a match for the prefixed word
+            # hasn't been found - therefore, remove the prefix and try adding it manually later.
+            # This is needed in some cases where it might seem like there is a prefix but there actually isn't one,
+            # for example "outside" 
+            if prefixIteration == 1:
+                # word = prefix + word
+                word = word[len(prefix):]
+                self.metrics.count("prefix_retries")
         
-        # First, check if the word is present in the list of irregular verbs and, if so, return it.
-        for irregular_verb in IRREGULAR_VERBS:
-            if irregular_verb == word:
+            # First, check if the word is present in the list of irregular verbs and, if so, return it.
+            if word in IRREGULAR_VERBS:
                 transcription = dict()
                 transcription["verb"] = []
                 # Because the part of the script that takes out the results looks at the second item in the list, there should be a placeholder.
                 transcription["verb"].append(None)
-                
+            
                 if prefixIteration == 0:
-                    transcription["verb"].append(IRREGULAR_VERBS[irregular_verb])
+                    transcription["verb"].append(IRREGULAR_VERBS[word])
                 else:
-                    transcription["verb"].append(PREFIX_TRANSCRIPTIONS[prefix] + IRREGULAR_VERBS[irregular_verb])
-                
-                transcription["verb"].append(IRREGULAR_VERBS[irregular_verb])
+                    transcription["verb"].append(PREFIX_TRANSCRIPTIONS[prefix] + IRREGULAR_VERBS[word])
+            
+                transcription["verb"].append(IRREGULAR_VERBS[word])
                 data.append(transcription)
                 return data
 
-        # If not, check if it's a contraction and get the actual determiner - the verb is added later.
-        for contraction in CONTRACTIONS:
-            if word == contraction:
+            # If not, check if it's a contraction and get the actual determiner - the verb is added later.
+            if word in CONTRACTIONS:
                 returnDict = dict()
                 returnDict["determiner, contraction"] = list()
-                returnDict["determiner, contraction"].append(CONTRACTIONS[contraction])
+                returnDict["determiner, contraction"].append(CONTRACTIONS[word])
                 data.append(returnDict)
                 return data
 
-        # Start querying the Oxford Learner's Dictionaries.
-
-        # The next lines check for special conditions.
-        isPossessive = False
-        isPluralOrThirdPerson = False
-        endsInLy = False
-        endsInEr = False
-        addTranscriptionLy = False
-        addTranscriptionEr = False
-
-        if word[-2:] == "'s" or word[-2:] == "’s":
-            word = word[:-2]
-            isPossessive = True
-        elif (word[-4:] == "sses") or (word[-1] == "s" and word[-4:] != "ness"):
-            isPluralOrThirdPerson = True
-        if word[-2:] == "ly":
-            endsInLy = True
-        if word[-2:] == "er":
-            endsInEr = True
+            # Start querying the Oxford Learner's Dictionaries.
+
+            # The next lines check for special conditions, see SUFFIX_RULES.
+            suffixes = classifySuffixes(word)
+            isPossessive = "possessive" in suffixes
+            if isPossessive:
+                word = stripSuffix(word, suffixes["possessive"])
+                suffixes = classifySuffixes(word)
+            isPluralOrThirdPerson = not isPossessive and suffixes.get("plural", False)
+            # Suffixes which are retried only once have to be taken from the word as it is now, not as it is when retrying.
+            pendingRetry = onceRetry(suffixes)
+            # Suffixes which have been removed from the word, their transcriptions are added to the result.
+            retried = []
         
-        iterateURLs = True
-        iteration = 1
+            iterateURLs = True
+            iteration = 1
 
-        try:
-            http = urllib3.PoolManager()
-
-            # Normally, only a single iteration is expected. This might change if special conditions, as defined above, exist.
-            while iterateURLs:
-                URL = baseURL + word.strip()
-                if VERBOSE_DEBUG: 
-                    print ("---- NEW ITERATION -", iteration, "----")
-                    print ("[*] [DEBUG] Word:", word)
-                parser = DictionaryParser()
-                openURL = http.request("GET", URL)
-                if VERBOSE_DEBUG: print ("[*] [DEBUG] Opening URL:", URL)
-                redirectedURL = openURL.geturl()
-                if VERBOSE_DEBUG: print ("[*] [DEBUG] Redirecting to URL:", redirectedURL)
+            try:
+                http = self.getHttpClient()
+
+                # Normally, only a single iteration is expected. This might change if special conditions, as defined above, exist.
+                while iterateURLs:
+                    URL = self.baseURL + word.strip()
+                    if VERBOSE_DEBUG: 
+                        print ("---- NEW ITERATION -", iteration, "----")
+                        print ("[*] [DEBUG] Word:", word)
+                    parser = DictionaryParser(stopEarly=self.isStreaming())
+                    # If the word is a form of a lemma whose page has been fetched already, that page is used, just as the
+                    # OLD would redirect to it.
+                    stored = self.lemmas.get(word) if self.lemmas is not None else None
+                    if stored is not None:
+                        if VERBOSE_DEBUG: print ("[*] [DEBUG] Using the stored page of", stored[0], "for", word)
+                        self.metrics.count("lemma_hits")
+                        parser.headWord, parser.found = stored
+                        status = 200
+                    else:
+                        openURL = self.fetchPage(http, URL, pages)
+                        if VERBOSE_DEBUG: print ("[*] [DEBUG] Opening URL:", URL)
+                        redirectedURL = openURL.geturl()
+                        if VERBOSE_DEBUG: print ("[*] [DEBUG] Redirecting to URL:", redirectedURL)
+                        status = openURL.status
                     
-                if openURL.status == 200:
-                    if VERBOSE_DEBUG: print ("[*] [DEBUG] Got status 200")
-                    parser.feed(openURL.data.decode())
-                    iterateURLs = False
-                    # Even though a query fails to find a word, HTTP 200 is returned. This means that either the word doesn't exist
-                    # or that further local processing is required related to special conditions.
-                    if parser.notFound:
-                        if word[-1] == 's':
-                            word = word[:-1]
-                            iterateURLs = True
-                        elif endsInLy:
-                            word = word[:-2]
-                            iterateURLs = True
-                            endsInLy = False
-                            addTranscriptionLy = True
-                        elif endsInEr:
-                            word = word[:-2]
-                            iterateURLs = True
-                            endsInEr = False
-                            addTranscriptionEr = True
-
-                    if bool(parser.found) and not parser.notFound:
-                        items = parser.found
+                    if status == 200:
+                        if VERBOSE_DEBUG: print ("[*] [DEBUG] Got status 200")
+                        if stored is None:
+                            self.feedPage(parser, openURL)
+                            if self.lemmas is not None and bool(parser.found) and not parser.notFound:
+                                self.lemmas.record(word, parser.headWord, parser.found)
+                        iterateURLs = False
+                        # Even though a query fails to find a word, HTTP 200 is returned. This means that either the word doesn't exist
+                        # or that further local processing is required related to special conditions.
+                        if parser.notFound:
+                            retry = nextRetry(word, pendingRetry)
+                            if retry is not None:
+                                if retry == pendingRetry:
+                                    pendingRetry = None
+                                word = stripSuffix(word, retry)
+                                retried.append(retry)
+                                self.metrics.count("suffix_retries")
+                                iterateURLs = True
+
+                        if bool(parser.found) and not parser.notFound:
+                            items = parser.found
                         
-                        if addTranscriptionEr:
-                            changeItems = getKeysList(items)
-                            for i in range(len(changeItems[0])):
-                                items[changeItems[0]][i] += "ə(r)"
+                            for suffix in retried:
+                                appendRetryTranscription(items, suffix)
                         
-                        if "noun" in items:
-                            if iteration == 1 and isPluralOrThirdPerson and parser.headWord == word:
-                                data.append(items)
-                            elif isPossessive or (word[-1] == 's' and word != parser.headWord) or isPluralOrThirdPerson:
-                                data.append(getPluralOrThirdPerson("noun", parser.headWord, items))
-                                if VERBOSE_DEBUG: print ("[*] [DEBUG] Word is possessive or plural, getting transcription...")
-                            else:
-                                data.append(items)
-                        elif "adjective" in items:
-                            if isPossessive or (word[-1] == 's' and word != parser.headWord) or isPluralOrThirdPerson:
-                                data.append(getPluralOrThirdPerson("adjective", parser.headWord, items))
-                                if VERBOSE_DEBUG: print ("[*] [DEBUG] Word is possessive or plural, getting transcription...")
-
-                            # https://youglish.com/pronounce/busiest/english offers different transcriptions for -er and -est.
-                            elif parser.headWord[:-1] in word and parser.headWord != word:
-                                if word[-2:] == "er":
-                                    for key in items:
-                                        items["adjective"][0] += "ə"
-                                elif word[-3:] == "est":
-                                    for item in items["adjective"]:
-                                        items["adjective"][0] += "ɪst"
-                                data.append(items)
-                            elif addTranscriptionLy:
-                                for i in range(len(items["adjective"])):
-                                    items["adjective"][i] += "lɪ"
-                                data.append(items)
-                            else:
+                            if "noun" in items:
+                                if iteration == 1 and isPluralOrThirdPerson and parser.headWord == word:
+                                    data.append(items)
+                                elif isPossessive or (word[-1] == 's' and word != parser.headWord) or isPluralOrThirdPerson:
+                                    data.append(getPluralOrThirdPerson("noun", parser.headWord, items))
+                                    if VERBOSE_DEBUG: print ("[*] [DEBUG] Word is possessive or plural, getting transcription...")
+                                else:
+                                    data.append(items)
+                            elif "adjective" in items:
+                                if isPossessive or (word[-1] == 's' and word != parser.headWord) or isPluralOrThirdPerson:
+                                    data.append(getPluralOrThirdPerson("adjective", parser.headWord, items))
+                                    if VERBOSE_DEBUG: print ("[*] [DEBUG] Word is possessive or plural, getting transcription...")
+
+                                # https://youglish.com/pronounce/busiest/english offers different transcriptions for -er and -est.
+                                elif parser.headWord[:-1] in word and parser.headWord != word:
+                                    degree = classifySuffixes(word).get("degree")
+                                    if degree is not None:
+                                        items["adjective"][0] += degree
+                                    data.append(items)
+                                else:
+                                    data.append(items)
+                            elif "verb" in items:
                                 data.append(items)
-                        elif "verb" in items:
-                            data.append(items)
-                        else:
-                            if isPossessive or (word[-1] == 's' and word != parser.headWord) or isPluralOrThirdPerson:
-                                data.append(getPluralOrThirdPerson(getKeysList(items)[0], parser.headWord, items))
-                                if VERBOSE_DEBUG: print ("[*] [DEBUG] Word is possessive or plural, getting transcription...")
                             else:
-                                data.append(items)
+                                if isPossessive or (word[-1] == 's' and word != parser.headWord) or isPluralOrThirdPerson:
+                                    data.append(getPluralOrThirdPerson(getKeysList(items)[0], parser.headWord, items))
+                                    if VERBOSE_DEBUG: print ("[*] [DEBUG] Word is possessive or plural, getting transcription...")
+                                else:
+                                    data.append(items)
                 
-                    if VERBOSE_DEBUG: 
-                        print ("[*] [DEBUG] Data so far:", data)
-                        print ("---- END ITERATION -", iteration, "----")
-                    iteration += 1
-                    parser.close()
-
-                # If a word is not found however, there's nothing else to do.
-                elif openURL.status == 404:
-                    if VERBOSE_DEBUG: print ("[*] [DEBUG] Got status 404")
-                    if VERBOSE_DEBUG: print ("[*] [DEBUG] URL", URL, "returned HTTP 404.")
-                    iterateURLs = False
-                # A different status code could mean anything so the script stops checkinf for this word.
-                else:
-                    if VERBOSE_DEBUG: print ("[*] [DEBUG] Got status", openURL.status, "- Stopping iterations")
-                    else: print("An error occurred.")
-                    iterateURLs = False
+                        if VERBOSE_DEBUG: 
+                            print ("[*] [DEBUG] Data so far:", data)
+                            print ("---- END ITERATION -", iteration, "----")
+                        iteration += 1
+                        parser.close()
+
+                    # If a word is not found however, there's nothing else to do.
+                    elif status == 404:
+                        if VERBOSE_DEBUG: print ("[*] [DEBUG] Got status 404")
+                        if VERBOSE_DEBUG: print ("[*] [DEBUG] URL", URL, "returned HTTP 404.")
+                        iterateURLs = False
+                    # A different status code could mean anything so the script stops checkinf for this word.
+                    else:
+                        if VERBOSE_DEBUG: print ("[*] [DEBUG] Got status", status, "- Stopping iterations")
+                        lookupErrors.append(status)
+                        iterateURLs = False
                 
-        except Exception as e:
-            print ("Something went wrong, check the following details for more information:")
-            print ("Exception Type:", type(e))
-            print ("Arguments", e.args)
-            print ("Exception txt:", e)
-
-        # If the requested word is found to have a prefix and this is the second iteration, this means that the word was earlier split
-        # so the prefix transcription has to be added now.
-        if prefixIteration == 1:
-            for dictionary in data:
-                for key in list(dictionary):
-                    arrLocation = 0
-                    for transcription in dictionary[key]:
-                        dictionary[key][arrLocation] = PREFIX_TRANSCRIPTIONS[prefix] + transcription
-                        arrLocation += 1
-
-        if (len(data) != 0):
-            if VERBOSE_DEBUG: print ("[*] [DEBUG] Returning", data)
-            return data
-        else:
-            if VERBOSE_DEBUG: print ("[*] [DEBUG] Got no data to return")
+            except Exception as e:
+                lookupErrors.append(e)
+                if VERBOSE_DEBUG:
+                    print ("[*] [DEBUG] Something went wrong, check the following details for more information:")
+                    print ("[*] [DEBUG] Exception Type:", type(e))
+                    print ("[*] [DEBUG] Arguments", e.args)
+                    print ("[*] [DEBUG] Exception txt:", e)
 
-# If this is a complex word, e.g. inter-change, split the words, get transcriptions for each and merge the results
-def getComplexTranscription(wordsCombination):
-    if "year" not in wordsCombination:
-        data = getTranscription(wordsCombination)
-        if (data != None):
-            for dictionary in data:
-                for key in dictionary:
-                    for element in dictionary[key]:
-                        return element
-
-    words = split(" |-|—|/|[|]", wordsCombination)
-    tempArray = ""
-    for word in words:
-        data = getTranscription(word)
-        for dictionary in data:
-            for key in dictionary:
-                # If the word is a verb, find out which is its proper form and use it as output.
-                if key == "verb":
-                    if word[-3:] == "ing":
-                        if syllableCount(word) == 1:
-                            tempArray += dictionary["verb"][0]
-                        else:
-                            if dictionary["verb"][-1][-2:] == "ɪŋ":
-                                tempArray += dictionary["verb"][-1] + " "
-                            elif dictionary["verb"][-2][-2:] == "ɪŋ":
-                                tempArray += dictionary["verb"][-2] + " "
-                            else:
-                                for transcription in dictionary["verb"]:
-                                    if transcription[-2:] == "ɪŋ":
-                                        tempArray += transcription + " "
-                    elif word[-1] == "s":
-                        if word[-2:] == "ss":
-                            tempArray += dictionary["verb"][1] + " "
-                        else:
-                            tempArray += dictionary["verb"][2] + " "
-                    elif word[-2:] == "ed":
-                        tempArray += dictionary["verb"][3] + " "
+            # If the requested word is found to have a prefix and this is the second iteration, this means that the word was earlier split
+            # so the prefix transcription has to be added now.
+            if prefixIteration == 1:
+                for dictionary in data:
+                    for key in list(dictionary):
+                        arrLocation = 0
+                        for transcription in dictionary[key]:
+                            dictionary[key][arrLocation] = PREFIX_TRANSCRIPTIONS[prefix] + transcription
+                            arrLocation += 1
+
+            if (len(data) != 0):
+                if VERBOSE_DEBUG: print ("[*] [DEBUG] Returning", data)
+                return data
+            else:
+                if VERBOSE_DEBUG: print ("[*] [DEBUG] Got no data to return")
+
+    # If this is a complex word, e.g. inter-change, split the words, get transcriptions for each and merge the results
+    def getComplexTranscription(self, wordsCombination):
+        with self.metrics.timed("complex"):
+            return self.joinTranscriptions(wordsCombination)
+
+    # The parts are looked up at the same time as the whole word, so a word that isn't found as a whole costs about as much
+    # as its slowest part - or nothing, if all parts have been looked up before. If the whole word has been resolved already
+    # (e.g. by the planning phase), the parts are only looked up if it wasn't found.
+    def joinTranscriptions(self, wordsCombination):
+        words = splitComplexWord(wordsCombination)
+        wholeResolved = "year" not in wordsCombination and self.isResolved(wordsCombination)
+        if wholeResolved:
+            element = firstTranscription(self.getTranscription(wordsCombination))
+            if element is not None:
+                return element
+        parts = [self.getPart(word) for word in words]
+        if "year" not in wordsCombination and not wholeResolved:
+            element = firstTranscription(self.getTranscription(wordsCombination))
+            if element is not None:
+                return element
+
+        tempArray = ""
+        for word, part in zip(words, parts):
+            data = part.result()
+            for group in data:
+                for entry in group:
+                    # If the word is a verb, use its proper form.
+                    if entry.pos == "verb":
+                        for transcription in entry.forms(word):
+                            tempArray += transcription + " "
+                    # Otherwise, use the first matched transcription.
                     else:
-                        tempArray += dictionary["verb"][1] + " "
-                # Otherwise, return all matched transcriptions.
+                        tempArray += entry.variants[0] + " "
+                        break
+        return tempArray.rstrip()
+
+    # Tells whether the word can be looked up without any request - it has been resolved by the planning phase or read from
+    # the cache by a cacheBatch.
+    def isResolved(self, word):
+        key = normalizeWord(word)
+        future = self.lookupMemo.get(key)
+        if future is not None:
+            return future.done()
+        with self.lock:
+            return self.batch is not None and key in self.batch["found"]
+
+    # Returns a future of getTranscription for a part of a complex word. The results of parts are kept for the whole run (up
+    # to PART_MEMO_SIZE of them), since the same parts tend to appear in many words. Lookups that raised are not kept.
+    def getPart(self, word):
+        key = normalizeWord(word)
+        with self.lock:
+            future = self.partMemo.get(key)
+            isNew = future is None
+            if isNew:
+                if self.phrasePool is None:
+                    self.phrasePool = ThreadPoolExecutor(max_workers=self.jobs * PHRASE_WIDTH)
+                future = self.partMemo[key] = self.phrasePool.submit(self.onBehalf(self.getTranscription), word)
+                if len(self.partMemo) > PART_MEMO_SIZE:
+                    self.partMemo.popitem(last=False)
+            else:
+                self.partMemo.move_to_end(key)
+        if isNew:
+            # Added outside of the lock, since the callback runs right away if the lookup is done already.
+            future.add_done_callback(lambda future: self.forgetPart(key, future))
+        else:
+            self.metrics.count("part_memo_hits")
+        return future
+
+    def forgetPart(self, key, future):
+        if future.exception() is not None:
+            with self.lock:
+                if self.partMemo.get(key) is future:
+                    del self.partMemo[key]
+
+    # Transcribes a single entry of the input. Returns a tuple (isComplex, result), where the result is a string for complex entries
+    # (see getComplexTranscription) and the Transcription returned by getTranscription otherwise.
+    # If the transcriber has a deadline, requests for the word aren't sent anymore once it has passed.
+    def transcribeWord(self, word):
+        self.metrics.count("words")
+        self.local.deadline = time.monotonic() + self.deadline if self.deadline > 0 else None
+        try:
+            with self.metrics.timed("word"):
+                if isComplexWord(word):
+                    return True, self.getComplexTranscription(word)
+                return False, self.getTranscription(word.lower())
+        except Exception as e:
+            self.metrics.count("errors", kind=errorKind(e))
+            raise
+        finally:
+            self.local.deadline = None
+
+    # Wraps a function called by another thread on behalf of the current one, so that it has the same deadline and the pages
+    # it requests are recorded for the same word (see recordValidators).
+    def onBehalf(self, function):
+        deadline = getattr(self.local, "deadline", None)
+        validators = getattr(self.local, "validators", None)
+        def call(*args):
+            self.local.deadline = deadline
+            self.local.validators = validators
+            try:
+                return function(*args)
+            finally:
+                self.local.deadline = None
+                self.local.validators = None
+        return call
+
+    # Transcribes the given items using a pool of "jobs" threads (self.jobs if not given). Yields tuples (item, future) in the
+    # same order as the items - or, if ordered is not set, in the order they're done - as soon as the future of each item is
+    # done. getWord returns the word of an item - items with no word (None) are skipped, their future's result is None.
+    # Only a limited amount of items is read ahead, so the input is never loaded at once.
+    def transcribeAll(self, items, jobs=None, getWord=lambda item: item, ordered=True):
+        if jobs is None:
+            jobs = self.jobs
+        if jobs <= 1:
+            for item in items:
+                future = Future()
+                word = getWord(item)
+                try:
+                    future.set_result(self.transcribeWord(word) if word is not None else None)
+                except Exception as e:
+                    future.set_exception(e)
+                yield item, future
+            return
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for item in items:
+                word = getWord(item)
+                if word is not None:
+                    pending.append((item, executor.submit(self.transcribeWord, word)))
                 else:
-                    tempArray += dictionary[key][0] + " "
+                    future = Future()
+                    future.set_result(None)
+                    pending.append((item, future))
+                if len(pending) >= jobs * 4:
+                    yield self.nextDone(pending, ordered)
+            while len(pending) > 0:
+                yield self.nextDone(pending, ordered)
+
+    # Transcribes a stream of words (e.g. the lines of a pipe) using a pool of "jobs" threads and yields tuples (word, future)
+    # in the same order, each as soon as it and the words before it are done. The words are read by a thread of their own, so
+    # a result is yielded right away even if the next word hasn't arrived yet. At most "window" words (4 per job by default)
+    # are read ahead of the first one that isn't done yet - that's all that's kept in memory, however long the stream is.
+    def transcribeStream(self, words, window=None):
+        if window is None:
+            window = self.jobs * 4
+        pending = queue.Queue(maxsize=max(window, 1))
+        end = object()
+        failure = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            def read():
+                try:
+                    for word in words:
+                        pending.put((word, executor.submit(self.transcribeWord, word)))
+                except Exception as e:
+                    failure.append(e)
+                finally:
+                    pending.put(end)
+            # If the results stop being read, the reader is left waiting - it mustn't keep the process alive.
+            threading.Thread(target=read, daemon=True).start()
+            while True:
+                item = pending.get()
+                if item is end:
                     break
-    return tempArray.rstrip()
+                wait([item[1]])
+                yield item
+        if len(failure) > 0:
+            raise failure[0]
+
+    # Waits for an item of transcribeAll to be done, removes it from the pending ones and returns it. If ordered is set,
+    # that's the first pending item, otherwise the first one that's done.
+    @staticmethod
+    def nextDone(pending, ordered):
+        if ordered:
+            item, future = pending.popleft()
+            wait([future])
+            return item, future
+        done = next(as_completed([future for item, future in pending]))
+        for index in range(len(pending)):
+            if pending[index][1] is done:
+                item, future = pending[index]
+                del pending[index]
+                return item, future
+
+    # Calls getTranscription once for each of the given words which hasn't been resolved yet, using a pool of "jobs" threads,
+    # and keeps the results in lookupMemo. Exceptions are kept as well and raised again when the word is requested.
+    def resolveLookups(self, words, jobs=None, onResolved=None):
+        if jobs is None:
+            jobs = self.jobs
+        unresolved = []
+        seen = set(self.lookupMemo)
+        for word in words:
+            word = normalizeWord(word)
+            if word not in seen:
+                seen.add(word)
+                unresolved.append(word)
+        if VERBOSE_DEBUG: print ("[*] [DEBUG] Resolving", len(unresolved), "unique lookup(s)")
+        resolved = dict()
+        with self.cacheBatch(unresolved), ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            for word in unresolved:
+                resolved[word] = executor.submit(self.getTranscription, word)
+            for count, word in enumerate(unresolved, 1):
+                wait([resolved[word]])
+                if onResolved is not None:
+                    onResolved(count, len(unresolved), word)
+        # The futures are only made visible once all of them are done, so a worker never waits for its own future.
+        self.lookupMemo.update(resolved)
+
+    # The planning phase - finds all lookups needed to transcribe the given words and resolves each unique one exactly once.
+    # Complex words are first looked up as a whole, just like getComplexTranscription does, and only the ones which aren't
+    # found that way are split and their parts looked up.
+    def planTranscriptions(self, words, jobs=None, onResolved=None):
+        complexWords = []
+        wholeWords = []
+        for word in words:
+            word = normalizeWord(word)
+            if isComplexWord(word):
+                complexWords.append(word)
+                if "year" in word:
+                    continue
+            wholeWords.append(word)
+        self.resolveLookups(wholeWords, jobs, onResolved)
+
+        parts = []
+        for word in complexWords:
+            if "year" in word:
+                parts.extend(splitComplexWord(word))
+            # If looking up the whole word failed, getComplexTranscription fails too, so the parts aren't needed.
+            elif self.lookupMemo[word].exception() is None and firstTranscription(self.lookupMemo[word].result()) is None:
+                parts.extend(splitComplexWord(word))
+        self.resolveLookups(parts, jobs, onResolved)
+
+# Returns the validators of a response - its ETag and Last-Modified headers - or None if it has neither.
+def pageValidators(response):
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+    validators = {"etag": headers.get("ETag"), "modified": headers.get("Last-Modified")}
+    if validators["etag"] is None and validators["modified"] is None:
+        return None
+    return validators
+
+# Fills the cache of the transcriber with the words (e.g. from a word frequency list) and refreshes the ones cached more than
+# refreshAfter days ago, using the transcriber's "jobs" threads. A stale word is revalidated with conditional requests for its
+# pages (If-None-Match/If-Modified-Since, with the validators the OLD sent last time) - if they haven't changed, the cached
+# result is kept and its age reset, otherwise the word is looked up again. Words with "year" are never looked up as a whole
+# (see getComplexTranscription), so their parts are warmed instead. Once "budget" requests have been sent (if it's above
+# 0), the remaining words are left for later. Returns the amount of words added, revalidated, changed, fresh (cached recently
+# enough to be left alone), lexicon (in the lexicon, which needs no cache), failed and unfinished (left because of the budget). onProgress is called with the amount of words
+# done, their total, the word and the amount of failed ones after each word.
+def warmCache(transcriber, words, budget=0, refreshAfter=WARM_REFRESH_DAYS, onProgress=None):
+    expanded = []
+    for word in words:
+        word = normalizeWord(word)
+        expanded.extend(splitComplexWord(word) if isComplexWord(word) and "year" in word else [word])
+    words = list(OrderedDict.fromkeys(word for word in expanded if word != ""))
+    counts = OrderedDict((outcome, 0) for outcome in ("added", "revalidated", "changed", "fresh", "lexicon", "failed", "unfinished"))
+    startRequests = transcriber.metrics.total("requests")
+
+    def warm(word, entry):
+        # The lexicon is used before the cache, so its words are never cached (or looked up).
+        if transcriber.lexicon is not None and transcriber.lexicon.get(word) is not None:
+            return "lexicon"
+        if budget > 0 and transcriber.metrics.total("requests") - startRequests >= budget:
+            return "unfinished"
+        if entry is None:
+            transcriber.recordValidators(word, transcriber.transcribeWord, word)
+            return "added"
+        data, age = entry
+        if age < refreshAfter * 24 * 60 * 60:
+            return "fresh"
+        return transcriber.revalidate(word, data)
+
+    done = 0
+    for chunk in chunked(words, CACHE_BATCH_SIZE):
+        entries = transcriber.cache.getEntries(chunk)
+        with transcriber.cacheBatch([word for word in chunk if word not in entries]), ThreadPoolExecutor(max_workers=transcriber.jobs) as executor:
+            futures = [executor.submit(warm, word, entries.get(word)) for word in chunk]
+            for word, future in zip(chunk, futures):
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    if VERBOSE_DEBUG: print ("[*] [DEBUG] Couldn't warm", word, "-", e)
+                    outcome = "failed"
+                counts[outcome] += 1
+                done += 1
+                if onProgress is not None:
+                    onProgress(done, len(words), word, counts["failed"])
+    return counts
+
+# Reads a word list for warmCache, one word per line. Anything after a tab or a comma (e.g. the frequency of the word in a
+# frequency list) is ignored.
+def readWordList(file):
+    for line in file:
+        word = line.split("\t")[0].split(",")[0]
+        if not word.startswith("#"):
+            word = normalizeWord(word)
+            if word != "":
+                yield word
+
+# Serves transcriptions over HTTP, as JSON. A single transcriber is shared by all requests, so its cache and connections
+# stay warm and concurrent lookups of the same word are coalesced. Words are transcribed by a pool of the transcriber's
+# "jobs" threads, and once more than maxPending words are waiting, new requests are turned away with HTTP 503.
+#   GET /transcribe?word=WORD         - {"word": ..., "complex": ..., "result": ...}
+#   POST /transcribe {"words": [...]} - {"results": [{"word": ..., "complex": ..., "result": ...}, ...]}
+#   GET /metrics                      - the metrics of the transcriber in the Prometheus format
+# The result is what getTranscription returns, or the string returned by getComplexTranscription for complex words. Words
+# that couldn't be transcribed have an "error" instead.
+class TranscriptionService:
+    def __init__(self, transcriber, host=SERVICE_HOST, port=SERVICE_PORT, maxPending=SERVICE_MAX_PENDING):
+        from http.server import ThreadingHTTPServer
+        self.transcriber = transcriber
+        self.maxPending = maxPending
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=transcriber.jobs)
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+
+    # Submits the words for transcription and returns their futures, or None if that would exceed maxPending.
+    def submit(self, words):
+        with self.lock:
+            if self.pending + len(words) > self.maxPending:
+                self.transcriber.metrics.count("rejected_requests")
+                return None
+            self.pending += len(words)
+        futures = []
+        for word in words:
+            future = self.executor.submit(self.transcriber.transcribe, word)
+            future.add_done_callback(self.release)
+            futures.append(future)
+        return futures
+
+    def release(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    @staticmethod
+    def result(word, future):
+        try:
+            isComplex, result = future.result()
+            if not isComplex and result is not None:
+                result = result.toData()
+            return {"word": word, "complex": isComplex, "result": result}
+        except Exception as e:
+            return {"word": word, "error": str(e)}
+
+    def handler(self):
+        from http.server import BaseHTTPRequestHandler
+        from urllib.parse import urlsplit, parse_qs
+        service = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                if VERBOSE_DEBUG: print ("[*] [DEBUG] [service]", format % args)
+
+            def do_GET(self):
+                URL = urlsplit(self.path)
+                if URL.path == "/transcribe":
+                    words = parse_qs(URL.query).get("word", [])
+                    if len(words) != 1 or words[0].strip() == "":
+                        return self.respond(400, {"error": "Pass exactly one word as ?word=..."})
+                    self.transcribe(words, single=True)
+                elif URL.path == "/metrics":
+                    self.respond(200, service.transcriber.metrics.prometheus(), "text/plain; version=0.0.4")
+                elif URL.path == "/health":
+                    self.respond(200, {"status": "ok", "pending": service.pending})
+                else:
+                    self.respond(404, {"error": "Not found"})
+
+            def do_POST(self):
+                if urlsplit(self.path).path != "/transcribe":
+                    return self.respond(404, {"error": "Not found"})
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+                    words = request["words"] if "words" in request else [request["word"]]
+                    if not all(isinstance(word, str) for word in words):
+                        raise ValueError("Words have to be strings")
+                except (ValueError, KeyError, TypeError) as e:
+                    return self.respond(400, {"error": "Expected {\"words\": [...]} or {\"word\": ...}: " + str(e)})
+                self.transcribe(words, single="words" not in request)
+
+            # Transcribes the words and responds with their results - or with just the result, if a single word was requested.
+            def transcribe(self, words, single=False):
+                if len(words) > service.maxPending:
+                    return self.respond(413, {"error": "At most {0} words can be sent at once".format(service.maxPending)})
+                futures = service.submit(words)
+                if futures is None:
+                    return self.respond(503, {"error": "Too many words are waiting, try again later"}, headers={"Retry-After": "1"})
+                results = [service.result(word, future) for word, future in zip(words, futures)]
+                if single:
+                    self.respond(500 if "error" in results[0] else 200, results[0])
+                else:
+                    self.respond(200, {"results": results})
+
+            def respond(self, status, body, contentType="application/json; charset=utf-8", headers=None):
+                if not isinstance(body, str):
+                    body = json.dumps(body, ensure_ascii=False)
+                body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or dict()).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+        return Handler
+
+    # Serves requests until interrupted.
+    def serve(self):
+        host, port = self.server.server_address[:2]
+        print ("Serving transcriptions on http://{0}:{1}/transcribe - press Ctrl+C to stop.".format(host, port))
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.server.server_close()
+        self.executor.shutdown()
+
+# The settings a Transcriber is created with by the command line interface, in a form that can be passed to worker processes.
+def transcriberSettings(args):
+    return {
+        "verbose": args.verbose,
+        "jobs": args.jobs,
+        "cacheFile": None if args.no_cache else args.cache_file,
+        "cacheTTL": args.cache_ttl,
+        "cacheSize": args.cache_size,
+        "lexiconIndex": None if args.no_lexicon else args.lexicon_index,
+        "pageStore": args.page_store if args.store_pages or args.reparse else None,
+        "reparse": args.reparse,
+        "stream": args.stream,
+        "speculate": args.speculate,
+        "retries": args.retries,
+        "backoff": args.backoff,
+        "rateLimit": args.rate_limit,
+        "burst": args.burst,
+        "plan": args.plan,
+        "lemmas": args.expand_inflections,
+        "timeout": args.timeout,
+        "deadline": args.deadline,
+        "hedge": args.hedge,
+        "hedgePercentile": args.hedge_percentile,
+        "breakerFailures": args.breaker_failures,
+        "breakerReset": args.breaker_reset,
+    }
+
+def createTranscriber(settings):
+    return Transcriber(
+        jobs=settings["jobs"],
+        cache=None if settings["cacheFile"] is None else openCache(settings["cacheFile"], settings["cacheTTL"], settings["cacheSize"]),
+        lexicon=LexiconIndex(settings["lexiconIndex"]) if settings["lexiconIndex"] is not None and os.path.exists(settings["lexiconIndex"]) else None,
+        pageStore=openPageStore(settings["pageStore"]) if settings["pageStore"] is not None else None,
+        reparse=settings["reparse"],
+        stream=settings["stream"],
+        speculate=settings["speculate"],
+        http=HttpClient(settings["retries"], settings["backoff"], settings["rateLimit"], settings["burst"],
+                        connectionCount(settings["jobs"], settings["speculate"]), settings["timeout"], settings["hedge"],
+                        settings["hedgePercentile"], settings["breakerFailures"], settings["breakerReset"]),
+        lemmas=settings["lemmas"],
+        deadline=settings["deadline"])
+
+# The transcriber of a worker process, see transcribeSharded.
+_workerTranscriber = None
+_workerPlan = False
+
+def initWorker(settings):
+    import multiprocessing.util
+    global VERBOSE_DEBUG, _workerTranscriber, _workerPlan
+    VERBOSE_DEBUG = settings["verbose"]
+    _workerTranscriber = createTranscriber(settings)
+    _workerPlan = settings["plan"]
+    # Close the cache (writing its times of use) and the connections when the worker exits. The atexit handlers aren't run
+    # in forked processes, the finalizers of multiprocessing are.
+    multiprocessing.util.Finalize(None, _workerTranscriber.close, exitpriority=10)
+
+# Transcribes a shard of words in a worker process. Returns a list of tuples (result, error) in the same order as the words,
+# along with the metrics of the shard. Errors are passed back as their messages.
+def transcribeShard(words):
+    transcriber = _workerTranscriber
+    jobs = None
+    results = []
+    # The whole shard is read from (and written to) the cache at once - failing to do either only costs the cache, see
+    # readCache and writeCache.
+    with transcriber.cacheBatch(words):
+        if _workerPlan:
+            transcriber.planTranscriptions([word for word in words if word is not None])
+            jobs = 1
+        for word, future in transcriber.transcribeAll(words, jobs, lambda word: word):
+            try:
+                results.append((future.result(), None))
+            except Exception as e:
+                results.append((None, str(e)))
+    # Keep the memory of the worker from growing with every shard.
+    transcriber.lookupMemo.clear()
+    return results, transcriber.metrics.drain()
+
+# Yields successive lists of up to "size" items.
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+# The same as Transcriber.transcribeAll, but the items are split into shards which are transcribed by a pool of worker
+# processes, each with its own transcriber (and connections) created from the settings. The results are yielded in the
+# same order as the items, and the metrics of the workers are merged into "metrics". The rate limit is split between them.
+def transcribeSharded(items, processes, settings, getWord=lambda item: item, metrics=None):
+    from concurrent.futures import ProcessPoolExecutor
+    settings = dict(settings, rateLimit=settings["rateLimit"] / processes, burst=max(settings["burst"] // processes, 1))
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=processes, initializer=initWorker, initargs=(settings,)) as executor:
+        for chunk in chunked(items, SHARD_SIZE):
+            pending.append((chunk, executor.submit(transcribeShard, [getWord(item) for item in chunk])))
+            # Only a few shards per process are read ahead.
+            if len(pending) >= processes * 2:
+                for result in shardResults(*pending.popleft(), metrics):
+                    yield result
+        while len(pending) > 0:
+            for result in shardResults(*pending.popleft(), metrics):
+                yield result
+
+def shardResults(chunk, shardFuture, metrics):
+    results, drained = shardFuture.result()
+    if metrics is not None:
+        metrics.merge(drained)
+    for item, (result, error) in zip(chunk, results):
+        future = Future()
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(error))
+        yield item, future
+
+_defaultTranscriber = None
+
+# Returns a Transcriber with the default settings, shared by the module-level functions below.
+def defaultTranscriber():
+    global _defaultTranscriber
+    if _defaultTranscriber is None:
+        _defaultTranscriber = Transcriber()
+    return _defaultTranscriber
+
+def getTranscription(wordToTranscribe, wordType=None):
+    return defaultTranscriber().getTranscription(wordToTranscribe, wordType)
+
+def getComplexTranscription(wordsCombination):
+    return defaultTranscriber().getComplexTranscription(wordsCombination)
+
+# Yields the normalized words of a plaintext file, ignoring commented and empty lines.
+def readPlaintextWords(file):
+    for word in file:
+        # Ignore commented words
+        if word[0] != '#':
+            word = word.strip(CHARACTERS_TO_STRIP)
+            word = word.replace("’", "'")
+            if word != '':
+                yield word
+
+# Yields tuples (row, word) for every row of the sheet, until column A is empty. Rows which already have a transcription
+# in column B are yielded with None in place of the word.
+def readWorkbookWords(sheet):
+    row = 1
+    while sheet.cell(row=row, column=1).value != None:
+        if sheet.cell(row=row, column=2).value == None:
+            yield row, normalizeCell(sheet.cell(row=row, column=1).value)
+        else:
+            yield row, None
+        row += 1
+
+def normalizeCell(word):
+    word = word.strip(CHARACTERS_TO_STRIP)
+    word = word.replace("’", "'")
+    return word.lower()
+
+# The same as readWorkbookWords, but for a read-only sheet, which can only be read row by row: yields tuples
+# (row, word, values), where values are the row's cells as they are. The rows after the first one with an empty column A
+# aren't transcribed, but they're yielded (with None in place of the row) so they can be copied.
+def readWorkbookRows(sheet):
+    row = 1
+    finished = False
+    for values in sheet.iter_rows(values_only=True):
+        if finished or len(values) == 0 or values[0] == None:
+            finished = True
+            yield None, None, values
+        elif len(values) < 2 or values[1] == None:
+            yield row, normalizeCell(values[0]), values
+        else:
+            yield row, None, values
+        row += 1
+
+def printTranscription(word, transcribed):
+    sys.stdout.write("".join(transcriptionLines(word, transcribed)))
+
+# Returns the lines printTranscription prints for a word. They're all put together first, so nothing is written for a word
+# that fails half-way through.
+def transcriptionLines(word, transcribed):
+    isComplex, result = transcribed
+    if isComplex:
+        return [word + " (complex)\n", "\t" + result + "\n"]
+    lines = []
+    word = word.lower()
+    for group in result:
+        for entry in group:
+            lines.append(word + ' (' + entry.pos + ')\n')
+            # The proper form of a verb, all matched transcriptions otherwise.
+            for transcription in entry.forms(word):
+                lines.append("\t" + transcription + "\n")
+    return lines
+
+# Returns the result of a word as a single record: the word as it was given and normalized, whether it was found, its parts
+# of speech, the transcriptions chosen for it (the ones printTranscription prints), all transcriptions by part of speech
+# and the error, if there was one.
+def transcriptionRecord(word, transcribed=None, error=None):
+    record = {"input": word, "word": normalizeWord(word), "found": False, "complex": isComplexWord(word), "pos": [], "chosen": [],
+              "variants": dict(), "error": None if error is None else str(error)}
+    if error is not None or transcribed is None:
+        return record
+    isComplex, result = transcribed
+    if isComplex:
+        record.update(found=result != "", complex=True, pos=["complex"], chosen=[result], variants={"complex": [result]})
+        return record
+    for group in result or []:
+        for entry in group:
+            record["pos"].append(entry.pos)
+            record["chosen"].extend(transcription for transcription in entry.forms(record["word"]) if transcription)
+            record["variants"].setdefault(entry.pos, []).extend(variant for variant in entry.variants if variant)
+    record["found"] = len(record["pos"]) > 0
+    return record
+
+# Output writers of the plaintext mode. Each one writes a word's whole result at once to a (buffered) text file.
+class TextWriter:
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, word, transcribed=None, error=None):
+        if error is None:
+            try:
+                self.file.write("".join(transcriptionLines(word, transcribed)))
+                return
+            except Exception as e:
+                error = e
+        self.file.write("An error occurred at word \"{0}\". Message: {1}\n".format(word, error))
+
+    def flush(self):
+        self.file.flush()
+
+    # Flushes the buffer and closes the file - stdout stays open.
+    def close(self):
+        self.file.close()
+
+# One JSON object (see transcriptionRecord) per line.
+class JsonLinesWriter(TextWriter):
+    def write(self, word, transcribed=None, error=None):
+        self.file.write(json.dumps(transcriptionRecord(word, transcribed, error), ensure_ascii=False) + "\n")
+
+# One row per word, with a header. Lists are joined by "; ", the variants are listed as "pos: transcription, ...".
+class DelimitedWriter(TextWriter):
+    COLUMNS = ["input", "word", "found", "complex", "pos", "chosen", "variants", "error"]
+
+    def __init__(self, file, delimiter=","):
+        TextWriter.__init__(self, file)
+        self.writer = csv.writer(file, delimiter=delimiter, lineterminator="\n")
+        self.writer.writerow(self.COLUMNS)
+
+    def write(self, word, transcribed=None, error=None):
+        record = transcriptionRecord(word, transcribed, error)
+        record["pos"] = "; ".join(record["pos"])
+        record["chosen"] = "; ".join(record["chosen"])
+        record["variants"] = "; ".join(wordType + ": " + ", ".join(variants) for wordType, variants in record["variants"].items())
+        record["found"] = "true" if record["found"] else "false"
+        record["complex"] = "true" if record["complex"] else "false"
+        record["error"] = record["error"] or ""
+        self.writer.writerow([record[column] for column in self.COLUMNS])
+
+OUTPUT_WRITERS = {
+    "text": TextWriter,
+    "jsonl": JsonLinesWriter,
+    "csv": lambda file: DelimitedWriter(file, ","),
+    "tsv": lambda file: DelimitedWriter(file, "\t"),
+}
+
+# Returns the output format matching the extension of the file, text if there is none.
+def outputFormat(filename):
+    if filename is not None:
+        extension = os.path.splitext(filename)[1].lower().lstrip(".")
+        if extension in OUTPUT_WRITERS:
+            return extension
+    return "text"
+
+# Opens the file (or stdout, if there is none) for a writer, with a large buffer. Stdout is line-buffered instead if it's a
+# terminal or if "interactive" is set (e.g. with --stdin, where whoever reads it waits for every line).
+def openOutput(filename, interactive=False):
+    if filename is None:
+        sys.stdout.flush()
+        buffering = 1 if interactive or sys.stdout.isatty() else OUTPUT_BUFFER_SIZE
+        return open(sys.stdout.fileno(), "w", encoding="utf-8", newline="", buffering=buffering, closefd=False)
+    return open(filename, "w", encoding="utf-8", newline="", buffering=OUTPUT_BUFFER_SIZE)
+
+def writeTranscription(sheet, row, word, transcribed):
+    # The transcriptions go to column B and the ones after it.
+    for column, value in enumerate(transcriptionCells(word, transcribed), 2):
+        sheet.cell(row=row, column=column, value=value)
+
+# Returns the values of the cells a word's transcriptions are written to, in order.
+def transcriptionCells(word, transcribed):
+    isComplex, result = transcribed
+    if isComplex:
+        return [result]
+    cells = []
+    for group in result:
+        for entry in group:
+            # If the word is a verb, use its proper form.
+            if entry.pos == "verb":
+                verbForms = entry.forms(word)
+                cells.append(verbForms[-1] if len(verbForms) != 0 else "")
+            # Otherwise, use all matched transcriptions.
+            else:
+                for transcription in entry.variants:
+                    if transcription != "":
+                        cells.append(transcription)
+    return cells
 
 def updateProgress(thisWord, totalWords, word, errorCount):
-    percentage = ("%.2f" % ((thisWord / totalWords) * 100))
+    # The amount of rows of a streamed sheet might not be known.
+    if totalWords is None:
+        totalWords = "?"
+        percentage = "?"
+    else:
+        percentage = ("%.2f" % ((thisWord / totalWords) * 100))
     sys.stdout.write("\rProgress: {0}/{1} ({2}%) ||| Errors: {3} ||| Current word is: {4}".format(thisWord, totalWords, percentage, errorCount, word))
     sys.stdout.flush()
     sys.stdout.write("\033[K")
@@ -545,9 +2950,6 @@ def updateProgress(thisWord, totalWords, word, errorCount):
     #     print ("\r\n")
     return
 
-def nextColumn(currentColumn):
-    return str(chr(ord(currentColumn) + 1))
-
 # Check if the file provided via argument is a valid file.
 def is_valid_file(parser, arg):
     if not os.path.exists(arg):
@@ -555,157 +2957,307 @@ def is_valid_file(parser, arg):
         sys.exit()
     return arg
 
-argParser = argparse.ArgumentParser(description="Get transcriptions for words from the Oxford Learner's Dictionaries.", allow_abbrev=False)
-argParser.add_argument("-v", "--verbose", help="Produce additional DEBUG output.", action="store_true")
-argParser.add_argument("-t", "--plaintext", help="If the file that has to be transcribed is not in Excel, use this flag.", action="store_true")
-argParser.add_argument('-f', "--file", help='Path to a .xls(x) or .txt file containing words to be transcribed. If .txt file, use -t flag', type=lambda x: is_valid_file(argParser, x), nargs=1, metavar='[File to get word forms from]')
-argParser.add_argument("-o", "--output", help="Save output to a separate file.", action="store", type=argparse.FileType('w'), nargs=1)
+# The command line interface.
+def main():
+    global VERBOSE_DEBUG
+    argParser = argparse.ArgumentParser(description="Get transcriptions for words from the Oxford Learner's Dictionaries.", allow_abbrev=False)
+    argParser.add_argument("-v", "--verbose", help="Produce additional DEBUG output.", action="store_true")
+    argParser.add_argument("-t", "--plaintext", help="If the file that has to be transcribed is not in Excel, use this flag.", action="store_true")
+    argParser.add_argument('-f', "--file", help='Path to a .xls(x) or .txt file containing words to be transcribed. If .txt file, use -t flag', type=lambda x: is_valid_file(argParser, x), nargs=1, metavar='[File to get word forms from]')
+    argParser.add_argument("-o", "--output", help="Save output to a separate file. For spreadsheets, the result is saved to this .xlsx file instead of the one supplied.", metavar="PATH")
+    argParser.add_argument("-F", "--format", help="Format of the plaintext output: text (the default), jsonl, csv or tsv. Taken from the extension of --output if not given.", choices=list(OUTPUT_WRITERS))
+    argParser.add_argument("--stream-xlsx", help="Read and write the spreadsheet row by row, using the same amount of memory however large it is. Only the values of the cells are kept, not their formatting.", action="store_true")
+    argParser.add_argument("--incremental", help="Only transcribe the lines of a plaintext file which are new or have changed since the last run with --incremental, taking the others from its manifest. The output is still complete.", action="store_true")
+    argParser.add_argument("--manifest", help="Path to the manifest of --incremental (default: the input file's path with .manifest added).", metavar="PATH")
+    argParser.add_argument("--resume", help="Continue an interrupted run - the rows whose results were saved in the journal aren't transcribed again.", action="store_true")
+    argParser.add_argument("--journal", help="Path to the journal of the results of each row, which is deleted once the output is written (default: the input file's path with .journal added).", metavar="PATH")
+    argParser.add_argument("--serve", help="Run as a service which transcribes words sent over HTTP as JSON, on the given port (default: %(const)s). Use --jobs to set how many words are transcribed at once.", nargs="?", type=int, const=SERVICE_PORT, metavar="PORT")
+    argParser.add_argument("--host", help="Address the service listens on (default: %(default)s).", default=SERVICE_HOST)
+    argParser.add_argument("--max-pending", help="Maximum amount of words waiting to be transcribed by the service before new requests are refused with HTTP 503 (default: %(default)s).", type=int, default=SERVICE_MAX_PENDING, metavar="N")
+    argParser.add_argument("-p", "--processes", help="Split the input into shards transcribed by N worker processes, each with its own --jobs threads (default: %(default)s). Not used by --serve.", type=int, default=1, metavar="N")
+    argParser.add_argument("--expand-inflections", help="Transcribe the regular forms of a word (plurals, verb forms, comparatives) from the page of the word itself once it has been fetched, without querying the OLD again. Forms are derived by spelling rules, leaving out the ones another word could have as well (\"hoped\" could be \"hop\" or \"hope\"), but words that only look like a form of another word (e.g. the adjective \"dogged\" and \"dog\") may still be transcribed wrongly.", action="store_true")
+    argParser.add_argument("--stdin", help="Read words from standard input, one per line, and write the result of each of them (in the same order) as soon as it's done. Meant for pipes - the input doesn't have to end.", action="store_true")
+    argParser.add_argument("--window", help="With --stdin, the maximum number of words read ahead of the first one that isn't done yet (default: 4 per job).", type=int, metavar="N")
+    argParser.add_argument("-j", "--jobs", help="Transcribe up to N words concurrently (default: %(default)s).", type=int, default=JOBS, metavar="N")
+    argParser.add_argument("--plan", help="Read the whole input first and look up every unique word (including the parts of complex words) only once.", action="store_true")
+    argParser.add_argument("--stream", help="Parse pages while they're being downloaded and stop as soon as the transcriptions have been found. Ignored with --store-pages, which needs whole pages.", action="store_true")
+    argParser.add_argument("--speculate", help="Request all forms of a word that might be needed (e.g. without the prefix or the trailing \"s\") at once instead of one after another. Faster, but sends more requests.", action="store_true")
+    argParser.add_argument("--retries", help="How many times a request that failed with a transient error (e.g. HTTP 429 or 503) is retried (default: %(default)s).", type=int, default=HTTP_RETRIES, metavar="N")
+    argParser.add_argument("--backoff", help="Backoff factor for retries - the n-th retry waits BACKOFF * 2^(n-1) seconds (default: %(default)s).", type=float, default=HTTP_BACKOFF, metavar="SECONDS")
+    argParser.add_argument("--rate-limit", help="Maximum amount of requests per second sent to the OLD by all jobs together, 0 for no limit (default: %(default)s).", type=float, default=HTTP_RATE_LIMIT, metavar="RPS")
+    argParser.add_argument("--burst", help="Amount of requests that may be sent at once before the rate limit applies (default: %(default)s).", type=int, default=HTTP_BURST, metavar="N")
+    argParser.add_argument("--timeout", help="Seconds a request may take to connect and between two reads before it fails, 0 for no limit (default: %(default)s).", type=float, default=HTTP_TIMEOUT, metavar="SECONDS")
+    argParser.add_argument("--deadline", help="Seconds a word may take altogether before it's marked as an error, 0 for no limit (default: %(default)s).", type=float, default=WORD_DEADLINE, metavar="SECONDS")
+    argParser.add_argument("--hedge", help="Send a request once more if it takes longer than most recent ones (see --hedge-percentile) and use whichever response comes first.", action="store_true")
+    argParser.add_argument("--hedge-percentile", help="Percentile of the latency of recent requests after which a request is hedged (default: %(default)s).", type=int, default=HEDGE_PERCENTILE, metavar="P")
+    argParser.add_argument("--breaker-failures", help="Stop sending requests after this many failed ones in a row, marking words as errors until the OLD recovers, 0 to never stop (default: %(default)s).", type=int, default=BREAKER_FAILURES, metavar="N")
+    argParser.add_argument("--breaker-reset", help="Seconds after which a single request is sent to check whether the OLD has recovered (default: %(default)s).", type=float, default=BREAKER_RESET, metavar="SECONDS")
+    argParser.add_argument("--store-pages", help="Save the raw pages fetched from the OLD, so they can be parsed again later with --reparse.", action="store_true")
+    argParser.add_argument("--reparse", help="Don't query the OLD - parse the pages saved with --store-pages again instead. Refreshes the cache with the new results.", action="store_true")
+    argParser.add_argument("--page-store", help="Path to the store of raw pages, or the redis://host[:port][/database] URL of a store shared by several machines (default: %(default)s).", default=PAGE_STORE_FILENAME, metavar="PATH")
+    argParser.add_argument("--build-lexicon", help="Build the lexicon index from CSV/TSV files with the columns word, part of speech and IPA, then exit. Later files override earlier ones.", nargs="+", metavar="FILE")
+    argParser.add_argument("--update-lexicon", help="Add the words from CSV/TSV lexicon files to the lexicon index, replacing existing ones, then exit.", nargs="+", metavar="FILE")
+    argParser.add_argument("--lexicon-index", help="Path to the lexicon index, which is used if it exists (default: %(default)s).", default=LEXICON_FILENAME, metavar="PATH")
+    argParser.add_argument("--no-lexicon", help="Don't use the lexicon index.", action="store_true")
+    argParser.add_argument("--metrics", help="Save a summary of the run (counters and latency histograms of each stage) as JSON.", metavar="PATH")
+    argParser.add_argument("--metrics-prom", help="Save the metrics of the run in the Prometheus textfile format.", metavar="PATH")
+    argParser.add_argument("--warm", help="Fill the cache with the words of a list (one per line, e.g. a word frequency list) and revalidate the cached ones older than --refresh-after with conditional requests, then exit.", metavar="FILE")
+    argParser.add_argument("--refresh-after", help="Days after which --warm revalidates a cached word (default: %(default)s).", type=float, default=WARM_REFRESH_DAYS, metavar="DAYS")
+    argParser.add_argument("--budget", help="Maximum number of requests --warm may send, 0 for no limit. The words left over are done by the next run.", type=int, default=0, metavar="REQUESTS")
+    argParser.add_argument("--no-cache", help="Bypass the transcription cache - always query the OLD and don't store the results.", action="store_true")
+    argParser.add_argument("--clear-cache", help="Remove all entries from the transcription cache and exit.", action="store_true")
+    argParser.add_argument("--cache-info", help="Print statistics about the transcription cache and exit.", action="store_true")
+    argParser.add_argument("--cache-file", help="Path to the transcription cache, or the redis://host[:port][/database] URL of a cache shared by several machines (default: %(default)s).", default=CACHE_FILENAME, metavar="PATH")
+    argParser.add_argument("--cache-ttl", help="Days after which cached transcriptions expire, 0 to never expire (default: %(default)s).", type=float, default=CACHE_TTL_DAYS, metavar="DAYS")
+    argParser.add_argument("--cache-size", help="Maximum number of cached words, 0 for no limit (default: %(default)s).", type=int, default=CACHE_MAX_ENTRIES, metavar="ENTRIES")
 
-args = argParser.parse_args()
 
-VERBOSE_DEBUG = args.verbose
-PLAINTEXT = args.plaintext
+    args = argParser.parse_args()
 
-if args.file is not None:
-    FILENAME = args.file[0]
-else:
-    FILENAME = "transcribe.xlsx"
+    VERBOSE_DEBUG = args.verbose
+    PLAINTEXT = args.plaintext
 
-if FILENAME[-3:] == "txt" and not PLAINTEXT:
-    print ("It looks like you're pointing to a .txt file - please use -t.")
-    sys.exit()
-elif FILENAME[-3:] == "xls" or FILENAME[-4:] == "xlsx" and PLAINTEXT:
-    print ("Looks like you're pointing to a .xls(x) file, please omit -t.")
-    sys.exit()
+    if args.build_lexicon or args.update_lexicon:
+        if args.build_lexicon:
+            count = buildLexicon(args.lexicon_index, args.build_lexicon)
+        else:
+            count = buildLexicon(args.lexicon_index, args.update_lexicon, update=True)
+        print ("Indexed {0} word(s) in {1}".format(count, args.lexicon_index))
+        sys.exit()
 
-if PLAINTEXT:
-    with open(FILENAME, 'r') as file:
-        for word in file:
-            try:
-                # Ignore commented words
-                if word[0] != '#':
-                    word = word.strip(CHARACTERS_TO_STRIP)
-                    word = word.replace("’", "'")
-                    if word != '':
-                        shouldContinue = True
-                        complex = False
-                        for separator in WORD_SEPARATORS:
-                            if separator in word:
-                                result = getComplexTranscription(word)
-                                print (word, "(complex)")
-                                print ("\t" + result)
-                                shouldContinue = False
-                        if shouldContinue:
-                            word = word.lower()
-                            result = getTranscription(word)
-                            for transcriptions in result:
-                                for wordType in transcriptions:
-                                    print(word + ' (' + wordType + ')')
-                                    # If the word is a verb, find out which is its proper form and use it as output.
-                                    if wordType == "verb":
-                                        if word[-3:] == "ing":
-                                            if syllableCount(word) == 1:
-                                                print ("\t" + transcriptions["verb"][0])
-                                            else:
-                                                if transcriptions["verb"][-1][-2:] == "ɪŋ":
-                                                    print ("\t" + transcriptions["verb"][-1])
-                                                elif transcriptions["verb"][-2][-2:] == "ɪŋ":
-                                                    print ("\t" + transcriptions["verb"][-2])
-                                                else:
-                                                    for transcription in transcriptions["verb"]:
-                                                        if transcription[-2:] == "ɪŋ":
-                                                            print ("\t" + transcription)
-                                        elif word[-1] == "s":
-                                            if word[-2:] == "ss":
-                                                print ("\t" + transcriptions["verb"][1])
-                                            else:
-                                                print ("\t" + transcriptions["verb"][2])
-                                        elif word[-2:] == "ed":
-                                            print ("\t" + transcriptions["verb"][3])
-                                        else:
-                                            print ("\t" + transcriptions["verb"][1])
-                                    # Otherwise, return all matched transcriptions.
-                                    else:
-                                        for transcription in transcriptions[wordType]:
-                                            print("\t" + transcription)
-            except Exception as e:
-                print ("An error occurred at word \"{0}\". Message: {1}".format(word, e))
-else:
-    workbook = load_workbook(filename=FILENAME)
-    sheet = workbook.active
-    totalWords = sheet.max_row
-    row = 1
-    errorCount = 0
-    rPos = "A" + str(1) # rPos = Read Position
-    wPos = "B" + str(1) # wPos = Write Position
-    while sheet[rPos].value != None:
-        if sheet[wPos].value == None:
-            shouldContinue = True
-            word = sheet[rPos].value
-            word = word.strip(CHARACTERS_TO_STRIP)
-            word = word.replace("’", "'")
-            word = word.lower()
-            if not VERBOSE_DEBUG:
-                updateProgress(row, totalWords, word, errorCount)
-            complex = False
+    if args.clear_cache or args.cache_info:
+        cache = openCache(args.cache_file, args.cache_ttl, args.cache_size)
+        if args.clear_cache:
+            cache.clear()
+            print ("Cleared the transcription cache at", args.cache_file)
+        if args.cache_info:
+            for key, value in cache.info().items():
+                print ("{0}: {1}".format(key, value))
+        cache.close()
+        sys.exit()
+
+    if args.warm is not None:
+        if args.no_cache or args.reparse:
+            print ("--warm fills the cache from the OLD, it can't be used with --no-cache or --reparse.")
+            sys.exit()
+        with createTranscriber(transcriberSettings(args)) as transcriber, open(args.warm, "r") as file:
+            counts = warmCache(transcriber, readWordList(file), args.budget, args.refresh_after,
+                               None if VERBOSE_DEBUG else lambda done, total, word, failed: updateProgress(done, total, word, failed))
+            if not VERBOSE_DEBUG: print ()
+            print (", ".join("{0} {1}".format(count, outcome) for outcome, count in counts.items()))
+            if args.metrics is not None:
+                transcriber.metrics.write(args.metrics)
+            if args.metrics_prom is not None:
+                transcriber.metrics.write(args.metrics_prom, prometheus=True)
+        sys.exit()
+
+    if args.reparse and not isRedisURL(args.page_store) and not os.path.exists(args.page_store):
+        print ("There is no page store at {0} - run with --store-pages first.".format(args.page_store))
+        sys.exit()
+
+    # There's no input file with --stdin - every word is written out as soon as it's done, see Transcriber.transcribeStream.
+    if args.stdin:
+        if args.incremental or args.resume or args.plan or args.processes > 1:
+            print ("--stdin transcribes words as they come, it can't be used with --incremental, --resume, --plan or --processes.")
+            sys.exit()
+        with createTranscriber(transcriberSettings(args)) as transcriber:
+            writer = OUTPUT_WRITERS[args.format or outputFormat(args.output)](openOutput(args.output, interactive=True))
             try:
-                for separator in WORD_SEPARATORS:
-                    if separator in word:
-                        result = getComplexTranscription(word)
-                        sheet[wPos] = result
-                        wPos = str(chr(ord(wPos[0]) + 1)) + str(row)
-                        shouldContinue = False
-                if shouldContinue:
-                    result = getTranscription(word)
-                    for transcriptions in result:
-                        for wordType in transcriptions:
-                            transcribed = ""
-                            # If the word is a verb, find out which is its proper form and use it as output.
-                            if wordType == "verb":
-                                if word[-3:] == "ing":
-                                    if syllableCount(word) == 1:
-                                        transcribed = transcriptions["verb"][0]
-                                    else:
-                                        if transcriptions["verb"][-1][-2:] == "ɪŋ":
-                                            transcribed = transcriptions["verb"][-1]
-                                        elif transcriptions["verb"][-2][-2:] == "ɪŋ":
-                                            transcribed = transcriptions["verb"][-2]
-                                        else:
-                                            for transcription in transcriptions["verb"]:
-                                                if transcription[-2:] == "ɪŋ":
-                                                    transcribed = transcription
-                                    
-                                elif word[-1] == "s":
-                                    if word[-2:] == "ss":
-                                        transcribed = transcriptions["verb"][1]
-                                    else:
-                                        transcribed = transcriptions["verb"][2]
-                                elif word[-2:] == "ed":
-                                    transcribed = transcriptions["verb"][3]
-                                else:
-                                    transcribed = transcriptions["verb"][1]
-                                sheet[wPos] = transcribed
-                                wPos = nextColumn(wPos[0]) + str(row)
-                            # Otherwise, return all matched transcriptions.
-                            else:
-                                for transcription in transcriptions[wordType]:
-                                    if transcription != "":
-                                        sheet[wPos] = transcription
-                                        wPos = nextColumn(wPos[0]) + str(row)
-            except Exception as e:
-                errorCount += 1
-        else:
-            if not VERBOSE_DEBUG:
-                updateProgress(row, totalWords, "*skipped*", errorCount)
-        if (row % 50 == 0):
-            workbook.save(filename=FILENAME)
-        row += 1
-        rPos = "A" + str(row)
-        wPos = "B" + str(row)
+                for word, future in transcriber.transcribeStream(readPlaintextWords(sys.stdin), args.window):
+                    try:
+                        writer.write(word, future.result())
+                    except Exception as e:
+                        writer.write(word, error=e)
+                    writer.flush()
+                writer.close()
+            except BrokenPipeError:
+                # Whoever read the output is gone (e.g. head), so there's no one left to transcribe for. Python would
+                # complain about stdout once more while exiting, so it's pointed elsewhere.
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                sys.exit(1)
+            if args.metrics is not None:
+                transcriber.metrics.write(args.metrics)
+            if args.metrics_prom is not None:
+                transcriber.metrics.write(args.metrics_prom, prometheus=True)
+        sys.exit()
 
-    workbook.save(filename=FILENAME)
-    workbook.close()
-    if (errorCount > 0):
-        print ("\n\rFinished with {0} error(s). Check the file you supplied (transcribe.xlsx by default).".format(errorCount))
+    if args.file is not None:
+        FILENAME = args.file[0]
     else:
-        print ("\n\rAll done - no problems encountered. Check the file you supplied (transcribe.xlsx by default).")
\ No newline at end of file
+        FILENAME = "transcribe.xlsx"
+
+    if FILENAME[-3:] == "txt" and not PLAINTEXT:
+        print ("It looks like you're pointing to a .txt file - please use -t.")
+        sys.exit()
+    elif FILENAME[-3:] == "xls" or FILENAME[-4:] == "xlsx" and PLAINTEXT:
+        print ("Looks like you're pointing to a .xls(x) file, please omit -t.")
+        sys.exit()
+
+    OUTPUT = args.output or FILENAME
+    if not PLAINTEXT and OUTPUT[-4:] != "xlsx":
+        print ("The result of a spreadsheet can only be saved to a .xlsx file.")
+        sys.exit()
+
+    # A journal is only left behind by a run that was interrupted - starting over would throw its results away.
+    journalFile = args.journal or FILENAME + ".journal"
+    if args.serve is None and not args.resume and os.path.exists(journalFile) and os.path.getsize(journalFile) > 0:
+        print ("There is a journal of an interrupted run at {0} - run with --resume to continue it, or delete it to start over.".format(journalFile))
+        sys.exit()
+
+    settings = transcriberSettings(args)
+    transcriber = createTranscriber(settings)
+
+    # With --processes, the words are transcribed (and planned) by worker processes, see transcribeSharded.
+    planInProcess = args.plan and args.processes <= 1
+    def transcribeItems(items, jobs, getWord):
+        if args.processes > 1:
+            return transcribeSharded(items, args.processes, settings, getWord, transcriber.metrics)
+        return transcriber.transcribeAll(items, jobs, getWord)
+
+    if args.serve is not None:
+        with transcriber:
+            TranscriptionService(transcriber, args.host, args.serve, args.max_pending).serve()
+            if args.metrics is not None:
+                transcriber.metrics.write(args.metrics)
+            if args.metrics_prom is not None:
+                transcriber.metrics.write(args.metrics_prom, prometheus=True)
+        sys.exit()
+
+    journal = Journal(journalFile, args.resume)
+
+    with transcriber:
+        if PLAINTEXT:
+            manifest = Manifest(args.manifest or FILENAME + ".manifest") if args.incremental else None
+            # The result of a line from the journal of an interrupted run or, with --incremental, from the previous run.
+            def recorded(index, word):
+                transcribed = journal.recorded(index, word)
+                if transcribed is None and manifest is not None:
+                    transcribed = manifest.recorded(word)
+                return transcribed
+
+            writer = OUTPUT_WRITERS[args.format or outputFormat(args.output)](openOutput(args.output))
+            with open(FILENAME, 'r') as file:
+                words = enumerate(readPlaintextWords(file), 1)
+                jobs = transcriber.jobs
+                if planInProcess:
+                    words = list(words)
+                    transcriber.planTranscriptions([word for index, word in words if recorded(index, word) is None])
+                    # Every lookup is resolved by now, so rendering doesn't need any workers.
+                    jobs = 1
+                for (index, word), future in transcribeItems(words, jobs, lambda item: None if recorded(*item) is not None else item[1]):
+                    transcribed = recorded(index, word)
+                    try:
+                        if transcribed is None:
+                            transcribed = future.result()
+                            journal.record(index, word, transcribed)
+                    except Exception as e:
+                        journal.record(index, word, error=str(e))
+                        writer.write(word, error=e)
+                        continue
+                    if manifest is not None:
+                        manifest.record(word, transcribed)
+                    writer.write(word, transcribed)
+            writer.close()
+            if manifest is not None:
+                manifest.save()
+        elif args.stream_xlsx:
+            from openpyxl import load_workbook, Workbook
+            source = load_workbook(filename=FILENAME, read_only=True)
+            output = Workbook(write_only=True)
+            errorCount = 0
+            for sheet in source.worksheets:
+                outputSheet = output.create_sheet(sheet.title)
+                # Only the active sheet is transcribed, the others are copied.
+                if sheet is not source.active:
+                    for values in sheet.iter_rows(values_only=True):
+                        outputSheet.append(values)
+                    continue
+                totalWords = sheet.max_row
+                rows = readWorkbookRows(sheet)
+                jobs = transcriber.jobs
+                if planInProcess:
+                    rows = list(rows)
+                    transcriber.planTranscriptions([word for row, word, values in rows if word is not None and journal.recorded(row, word) is None], onResolved=
+                                                   None if VERBOSE_DEBUG else lambda count, total, word: updateProgress(count, total, word, errorCount))
+                    if not VERBOSE_DEBUG: print ()
+                    jobs = 1
+                for (row, word, values), future in transcribeItems(rows, jobs, lambda item: None if journal.recorded(item[0], item[1]) is not None else item[1]):
+                    if word is not None:
+                        if not VERBOSE_DEBUG:
+                            updateProgress(row, totalWords, word, errorCount)
+                        transcribed = journal.recorded(row, word)
+                        try:
+                            if transcribed is None:
+                                transcribed = future.result()
+                                journal.record(row, word, transcribed)
+                            # The transcriptions replace the cells from column B on, the ones after them are kept.
+                            cells = transcriptionCells(word, transcribed)
+                            outputSheet.append([values[0]] + cells + list(values[1 + len(cells):]))
+                            continue
+                        except Exception as e:
+                            journal.record(row, word, error=str(e))
+                            errorCount += 1
+                    elif row is not None and not VERBOSE_DEBUG:
+                        updateProgress(row, totalWords, "*skipped*", errorCount)
+                    outputSheet.append(values)
+            source.close()
+            # The new workbook replaces the original one only once it's complete.
+            temporary = OUTPUT + ".tmp.xlsx"
+            with transcriber.metrics.timed("save"):
+                output.save(temporary)
+            os.replace(temporary, OUTPUT)
+            if (errorCount > 0):
+                print ("\n\rFinished with {0} error(s). Check the file you supplied (transcribe.xlsx by default).".format(errorCount))
+            else:
+                print ("\n\rAll done - no problems encountered. Check the file you supplied (transcribe.xlsx by default).")
+        else:
+            from openpyxl import load_workbook
+            workbook = load_workbook(filename=FILENAME)
+            sheet = workbook.active
+            totalWords = sheet.max_row
+            errorCount = 0
+            rows = readWorkbookWords(sheet)
+            jobs = transcriber.jobs
+            if planInProcess:
+                rows = list(rows)
+                transcriber.planTranscriptions([word for row, word in rows if word is not None and journal.recorded(row, word) is None], onResolved=
+                                               None if VERBOSE_DEBUG else lambda count, total, word: updateProgress(count, total, word, errorCount))
+                if not VERBOSE_DEBUG: print ()
+                jobs = 1
+            for (row, word), future in transcribeItems(rows, jobs, lambda item: None if journal.recorded(*item) is not None else item[1]):
+                if word is not None:
+                    if not VERBOSE_DEBUG:
+                        updateProgress(row, totalWords, word, errorCount)
+                    transcribed = journal.recorded(row, word)
+                    try:
+                        if transcribed is None:
+                            transcribed = future.result()
+                            journal.record(row, word, transcribed)
+                        writeTranscription(sheet, row, word, transcribed)
+                    except Exception as e:
+                        journal.record(row, word, error=str(e))
+                        errorCount += 1
+                else:
+                    if not VERBOSE_DEBUG:
+                        updateProgress(row, totalWords, "*skipped*", errorCount)
+
+            # The workbook is only saved once - until then, the journal keeps the results.
+            with transcriber.metrics.timed("save"):
+                workbook.save(filename=OUTPUT)
+            workbook.close()
+            if (errorCount > 0):
+                print ("\n\rFinished with {0} error(s). Check the file you supplied (transcribe.xlsx by default).".format(errorCount))
+            else:
+                print ("\n\rAll done - no problems encountered. Check the file you supplied (transcribe.xlsx by default).")
+
+        journal.remove()
+
+        if transcriber.cache is not None:
+            if VERBOSE_DEBUG: print ("[*] [DEBUG] Cache hits:", transcriber.cache.hits, "misses:", transcriber.cache.misses)
+        if args.metrics is not None:
+            transcriber.metrics.write(args.metrics)
+        if args.metrics_prom is not None:
+            transcriber.metrics.write(args.metrics_prom, prometheus=True)
+
+if __name__ == "__main__":
+    main()